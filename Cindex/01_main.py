@@ -31,6 +31,8 @@ from scipy.stats import gamma, norm
 # PUT HERE THE PATH OF THE DIRECTORY WITH DATA
 
 from Cindex.utils import Cindex
+from DB_population.feature_utils import add_features
+from DB_population.parquet_utils import read_flat_parquet
 
 # ------------------------------------------------------------------------------
 # Load the test data:
@@ -38,104 +40,17 @@ from Cindex.utils import Cindex
 # In the example inputs data (text data in CSV format) are already standardized in Z-scores.
 
 
-# Step 1: Load data
-flat_df = pd.read_csv("clustering_AC/clustering_pipeline/data/flat_df.csv")  # Load data into a DataFrame
-
 year = 2016
-# Filter data for the selected year
+
+# Step 1: Load data of the selected year only (its Parquet partition)
 print(f"Filtering year for selected value: {year}")
-flat_df = flat_df.query(f"year=={year}")
+flat_df = read_flat_parquet("clustering_AC/clustering_pipeline/data/flat_df_parquet", years=[year])
 
 if flat_df.empty:
 	raise Exception(
 		f"Emtpy DataFram with year {year}. Please, select another value."
 	)
 
-# Calculate farm yield as produced quantity per crop acreage
-flat_df = flat_df.assign(
-	crop_yield=lambda x: x.produced_quantity / x.crop_acreage
-)
-
-
-flat_df["phyto_costs_ha"] = flat_df['phyto_costs'] / flat_df['crop_acreage']
-
-
-flat_df["fert_costs_ha"] = flat_df['fert_costs'] / flat_df['crop_acreage']
-
-
-
-
-# ======= PYTHO AGGREGATION and Normaliztion to acrage==============================
-# Step 2: Basic Feature Engineering
-# Identify all columns related to herbicides
-herbicide_cols = [elem for elem in flat_df.columns if "Herbicide_Qt" in elem]
-# Compute the herbicide ratio relative to crop acreage
-flat_df["herbicide_ha"] = (
-		flat_df[herbicide_cols].sum(axis=1) / flat_df["crop_acreage"]
-)
-
-insecticide_cols = [elem for elem in flat_df.columns if "Insecticide_Qt" in elem]
-# Compute the herbicide ratio relative to crop acreage
-flat_df["insecticide_ha"] = (
-		flat_df[insecticide_cols].sum(axis=1) / flat_df["crop_acreage"]
-)
-
-fungicide_cols = [elem for elem in flat_df.columns if "Fungicide_Qt" in elem]
-# Compute the herbicide ratio relative to crop acreage
-flat_df["fungicide_ha"] = (
-		flat_df[fungicide_cols].sum(axis=1) / flat_df["crop_acreage"]
-)
-
-# Step 3: Performance Ratios
-# Calculate the ratio of herbicide use relative to yield
-flat_df["herbicide_efficiency"] = flat_df["herbicide_ha"]/ flat_df["crop_yield"]
-flat_df["insecticide_efficiency"] =  flat_df["insecticide_ha"]/ flat_df["crop_yield"]
-flat_df["fungicide_efficiency"] = flat_df["fungicide_ha"]/ flat_df["crop_yield"]
-
-phyto_cols = ["herbicide_efficiency","insecticide_efficiency","fungicide_efficiency"]
-flat_df["phyto_efficiency"] = (
-		flat_df[phyto_cols].sum(axis=1)
-)
-
-# ======= Ferti AGGREGATION and Normaliztion to acrage==============================
-# Define columns representing essential elements for crop nutrition
-keywords = ['nitrogen_ha', 'phosphorus_ha', 'potassium_ha']
-new_cols = ['Nha_efficiency','Pha_efficiency','Kha_efficiency']
-for k,c in zip(keywords,new_cols):
-	x_cols = [elem for elem in flat_df.columns if k in elem]
-	flat_df[c] =  flat_df[x_cols].sum(axis=1)/ flat_df["crop_yield"]
-
-# Calculate total elements ratio over yield
-flat_df["ferti_efficiency"] = flat_df[new_cols].sum(axis=1)
-
-# Calculate hours of machinery use per hectare relative to yield
-flat_df["hr_machines_efficiency"] =  flat_df["hours_of_machines_ha"]/flat_df["crop_yield"]
-
-
-# Cost efficiency
-flat_df["fert_cost_ha"] = flat_df["fert_costs"] / flat_df["crop_acreage"]
-
-flat_df["phyto_cost_ha"] = flat_df["phyto_costs"] / flat_df["crop_acreage"]
-
-
-flat_df["human_costs_ha"] = flat_df["human_costs"] / flat_df["crop_acreage"]
-
-
-flat_df["machinery_costs_ha"] = flat_df["machinery_costs"] / flat_df["crop_acreage"]
-
-
-flat_df["fert_cost_efficiency"] = flat_df["fert_costs_ha"]/flat_df["crop_yield"]
-
-flat_df["phyto_cost_efficiency"] =flat_df["phyto_cost_ha"]/flat_df["crop_yield"]
-
-flat_df["human_costs_efficiency"] = flat_df["human_costs_ha"]/flat_df["crop_yield"]
-
-flat_df["machinery_costs_efficiency"] = flat_df["machinery_costs_ha"]/flat_df["crop_yield"]
-
-flat_df["energy_costs_efficiency"] = (flat_df["energy_costs"]/flat_df["crop_acreage"])/flat_df["crop_yield"]
-
-flat_df["thirdy_costs_efficiency"] = (flat_df["thirdy_costs"]/flat_df["crop_acreage"])/flat_df["crop_yield"]
-
 # ======= INU FEATURES ==============================
 # Step 4: Filter Relevant Columns
 # List of clustering input features (some columns are commented out but kept for reference)
@@ -153,9 +68,9 @@ input_l = [
 	'phyto_cost_efficiency',
 	'human_costs_efficiency',
 	'machinery_costs_efficiency',
-	# 'phyto_efficiency',
-	# 'ferti_efficiency',
-	# 'hr_machines_efficiency'
+	# 'phyto_inefficiency',
+	# 'ferti_inefficiency',
+	# 'hours_of_machines_inefficiency'
 ]
 
 # input_l = [
@@ -167,6 +82,10 @@ input_l = [
 # 	'hours_of_machines_ha_over_yield']
 # ]
 
+# the features (crop yield, costs per hectare over the yield, ...) are computed from the
+# flat panel, see DB_population/feature_utils
+flat_df = add_features(flat_df, input_l, recompute=True)
+
 # Step 5: Handle Infinite Values
 # Remove rows containing infinite values in the specified input columns
 data = flat_df[input_l]
@@ -13,12 +13,27 @@ It performs the following steps:
 The output dataset includes variables such as crop acreage, production costs, fertilizer application rates, and phytosanitary usage profiles across farms and years.
 """
 
-import json
+import os
+
 import numpy as np
 import pandas as pd
 
-with open("DB_population/ecowheataly_database.json") as ewdj:
-    data = json.load(ewdj)
+from DB_population.feature_utils import add_features
+from DB_population.flat_utils import flatten_datastore
+from DB_population.json_utils import read_datastore
+from DB_population.parquet_utils import write_flat_parquet
+
+# on machines with little memory, set LOW_MEMORY to parse the database one farm at a time
+# (see json_utils.stream_datastore) instead of loading it at once;
+# a compressed database (.json.gz, .json.zst) is decompressed as it is read
+LOW_MEMORY = False
+# processes for the outlier removal
+WORKERS = os.cpu_count() or 1
+DATABASE = "DB_population/ecowheataly_database.json"
+if LOW_MEMORY:
+    data = DATABASE
+else:
+    data = read_datastore(DATABASE)
 
 # anno, colture, Frumento duro, fertilizzanti, fitofarmaci
 wheat_vars = ['produced_quantity','PLV','crop_acreage','hours_of_machines_ha','fert_costs','phyto_costs',
@@ -33,192 +48,27 @@ phy_vars = ['phyto_area','distribuited_quantity_ha','unit_cost','distribuited_va
 
 
 years = np.arange(2008,2023)
-species = 'common_wheat'
-
-farms = []
-for key, val in data.items():
-  # print(key,val)
-    farms.append(key)
-farms = np.array(farms)
-
-## part 1 -  general data
-
-# -------------- PUT THE SCRIPT INTO A FUNCTION----------------------------
-def extract_data(data, anno, farms, wheat_vars, species='durum_wheat'):
-    columns =['year', 'farm code',species,'farm_acreage'] + wheat_vars + fert_vars
-    data_list = []
-
-    for fid in farms:
-        try:
-            farm_acreage = data[fid]['years'][anno]['farm_acreage']
-            # crop == datasubset
-            crop = data[fid]['years'][anno][species]
-            row = [anno, fid,species,farm_acreage]
-
-            # extract data recalled in wheat_vars
-            row.extend(crop.get(key, 0) for key in wheat_vars)
-
-            data_list.append(row)
-        except KeyError:
-            # Handle KeyError more gracefully, e.g., log the error or return partial data
-            pass
-    # mat = np.array(data_list)
-    # df = pd.DataFrame(data_list, columns=columns)
-    return data_list
-
-# # CHECKS:
-# anno1 = '2011'
-# Vars_name = ['year', 'farm code','farm_acreage','species'] + wheat_vars + fert_vars
-# Mat = extract_data(data, anno1, farms, wheat_vars, fert_vars)
-# df2 = pd.DataFrame(Mat,columns=Vars_name)
-
-Vars_name = ['year', 'farm code','species','farm_acreage'] + wheat_vars
-years = np.arange(2008,2023)
-for year in years:
-    if year == years[0]:
-        Mat = extract_data(data, str(year), farms, wheat_vars,species=species)
-    else:
-        mat = extract_data(data, str(year), farms, wheat_vars,species=species)
-        Mat.extend(mat)
-
-
-dtypes = {}
-for i in range(len(Vars_name)):
-    if i <2:
-        dtypes[i] ='int'
-    elif i ==3:
-        dtypes[i] ='float'
-    elif i ==2:
-        dtypes[i] = 'str'
-    else:
-        dtypes[i] = 'float'
-
-df1 = pd.DataFrame(Mat,columns=Vars_name)
-dtypes1 = {col: 'int' if i < 2 else 'float' if i == 3 else 'str' if i == 2 else 'float' for i, col in enumerate(df1.columns)}
-df1 = df1.astype(dtypes1)
-
-# NOTES:
-# >> manage the "inf" in the hours_of_machines (due to 0 costs in the Azienda.scv files)
+# the crops: with several crops (e.g. ['durum_wheat', 'common_wheat']) their rows are read
+# in the same traversal and stacked in one flat_df, told apart by its "species" column;
+# outliers are then removed, and the logs written, per crop
+species = ['common_wheat']
 
-## PART 2 : Pythosanitary
-# fertilizzanti, fitofarmaci
-# fert_vars_type = ['Mineral','OrganoMineral','Other','Micro_Mineral']
-
-Mat2 = []
-
-for year in years:
-    for fid in farms:
-        row = [year,fid]
-        try:
-            crop = data[fid]["years"][str(year)][species]
-            fert = crop.get("fertilizers", {})
-        except KeyError:
-            fert = {}
-
-        for ftype in fert_vars_type:
-            values = fert.get(ftype, {})
-            for var in fert_vars:
-                # print(var)
-                # print(values.get(var, 0))
-                colname = f"{ftype}_{var}"
-                # Se var è una chiave presente in values, allora viene usato il valore associato, anche se è np.nan.
-                # Se var NON è una chiave di values, allora viene usato il default 0.
-                row.append(values.get(var, 0))
-
-        Mat2.append(row)
-
-# Convert to DataFrame
-df_colname  = ['year','farm code']
-for t in fert_vars_type:
-    for c in fert_vars:
-        df_colname.append(t+'_'+c)
-df2 = pd.DataFrame(Mat2,columns=df_colname)
-dtypes2 = {col: 'int' if i < 2  else 'float' for i, col in enumerate(df2.columns)}
-df2 = df2.astype(dtypes2)
-
-
-## PART 3 : Pythosanitary
+## part 1, 2, 3 - general data, fertilizers and pythosanitary
 
+# every farm-year with data on a crop is visited once and gives its row of the flat panel
+# (see flat_utils.flatten_datastore), by crop in year-major order; the pesticide quantities
+# are summed by toxicity class, 0 without data on a class (NaN without pesticide data)
 types  =['Herbicide', 'Insecticide', 'Fungicide']
-ColName = ['year','farm code','Qt Tox-0','Qt Tox-1','Qt Tox-2','Qt Tox-3','Qt Tox-4']
-Mat3 = []
-for T,TYPE in enumerate(types):
-    print(f'organizzando {TYPE}')
-    mat = []
-    for year in years:
-        for i, fid in enumerate(farms):
-            try:
-                # ------------prova 1----------------------------------------
-
-                crop = data[fid]['years'][str(year)][species]
-                row = np.full((len(ColName),), np.nan, dtype=object)
-                row[0:2] = [year,int(fid)]
-
-                # Estrazione variabili ft
-                phyto = crop['phytosanitary']
-
-                try:
-
-                    val = {}
-                    for item in phyto[TYPE].keys():
-                        # print(item)
-                        classe=int(item)
-                        item_data = phyto[TYPE][item]
-                        qt_ha = item_data['distributed_quantity_ha'] #* item_data['phyto_area']
-                        val[classe] = val.get(classe, 0) + qt_ha
-                        # print(val)
-                    for c,v in val.items():
-                        row[c+2]= float(v)
-                    mat.append(row)
-                except:
-                    mat.append(row) # year, farm code + 5 nan
-
-            except KeyError:
-                pass
-    Mat3.append(mat)
+flat_df, Phyto = flatten_datastore(data, species, years, wheat_vars, fert_vars_type, fert_vars, types)
 
-# store the data into 3D arrays for plots
-Phyto = np.stack(Mat3,axis=2)
-
-Mat3 = np.concatenate(Mat3,axis=1)
-
-df_colname  = []
-for t in types:
-    for c in ColName:
-        if (c==ColName[0]) | (c==ColName[1]):
-            df_colname.append(c)
-        else:
-            df_colname.append(t+'_'+c)
-
-
-# afterchecks we can delete redundant colum:
-cols_todel = [7,8,14,15]
-df_colname = np.delete(df_colname,cols_todel)
-Mat3 = np.delete(Mat3,cols_todel,axis=1)
-
-
-df3 = pd.DataFrame(Mat3, columns=df_colname)
-dtypes3 = {col: 'int' if i < 2  else 'float' for i, col in enumerate(df3.columns)}
-df3 = df3.astype(dtypes3)
-# here we got NaN that must be changed by zero (if at least 1 pythosanitary priducts has been used)
-# mx = np.shape(Mat3)[1] - 2
-# ii = np.sum(np.isnan(Mat3[:,2::].astype(float)),axis=1)
-# id_to_del = np.where(ii==mx)[0]
-df3.fillna(0, inplace=True) #cheked! nan are 0 uses
-
-
-## MERGING df1 with df2
-
-temp_df = pd.merge(df1, df2, on=['year', 'farm code'], how='left')
-flat_df = pd.merge(temp_df,df3,on=['year', 'farm code'], how='left' )
+# NOTES:
+# >> manage the "inf" in the hours_of_machines (due to 0 costs in the Azienda.scv files)
 
 
-## Add some extra columns
+## Add some extra columns (see feature_utils for their definitions)
 
 # Calculate farm yield as produced quantity per crop acreage
-flat_df = flat_df.assign(
-	crop_yield=lambda x: x.produced_quantity / x.crop_acreage
-)
+flat_df = add_features(flat_df, ['crop_yield'])
 
 print('crop yield cannot be zero: removing few rows...')
 flat_df.loc[flat_df['crop_yield'] == 0, 'crop_yield'] = np.nan
@@ -228,88 +78,45 @@ print('Hours of machine has few inf... let us remove them')
 n_inf = np.isinf(flat_df.iloc[:,4::].astype(float)).sum()
 flat_df.replace([np.inf, -np.inf], np.nan, inplace=True)
 
-# Normalize some vslues:
-flat_df["PLV_2_Qt"] = flat_df['PLV'] / flat_df['produced_quantity']
-
-
-flat_df["phyto_costs_2_Qt"] = flat_df['phyto_costs'] / flat_df['produced_quantity']
-
-
-flat_df["fert_costs_2_Qt"] = flat_df['fert_costs'] / flat_df['produced_quantity']
-
-
-
-
-# ======= PYTHO AGGREGATION and Normaliztion to acrage==============================
-# Step 2: Basic Feature Engineering
-# Identify all columns related to herbicides
-herbicide_cols = [elem for elem in flat_df.columns if "Herbicide_Qt" in elem]
-# Compute the herbicide ratio relative to crop acreage
-flat_df["herbicide_ha"] = (
-		flat_df[herbicide_cols].sum(axis=1) / flat_df["crop_acreage"]
-)
-
-insecticide_cols = [elem for elem in flat_df.columns if "Insecticide_Qt" in elem]
-# Compute the herbicide ratio relative to crop acreage
-flat_df["insecticide_ha"] = (
-		flat_df[insecticide_cols].sum(axis=1) / flat_df["crop_acreage"]
-)
-
-fungicide_cols = [elem for elem in flat_df.columns if "Fungicide_Qt" in elem]
-# Compute the herbicide ratio relative to crop acreage
-flat_df["fungicide_ha"] = (
-		flat_df[fungicide_cols].sum(axis=1) / flat_df["crop_acreage"]
-)
-
-# Step 3: Performance Ratios
-# Calculate the ratio of herbicide use relative to yield
-flat_df["herbicide_inefficiency"] = flat_df["herbicide_ha"] / flat_df["crop_yield"]
-flat_df["insecticide_inefficiency"] = flat_df["insecticide_ha"] / flat_df["crop_yield"]
-flat_df["fungicide_inefficiency"] = flat_df["fungicide_ha"] / flat_df["crop_yield"]
-
-phyto_cols = ["herbicide_inefficiency","insecticide_inefficiency","fungicide_inefficiency"]
-flat_df["phyto_inefficiency"] = (
-		flat_df[phyto_cols].sum(axis=1)
-)
-
-# ======= Ferti AGGREGATION and Normaliztion to acrage==============================
-# Define columns representing essential elements for crop nutrition
-keywords = ['nitrogen_ha', 'phosphorus_ha', 'potassium_ha']
-new_cols = ['N_ha','P_ha','K_ha']
-for k,c in zip(keywords,new_cols):
-	x_cols = [elem for elem in flat_df.columns if k in elem]
-	flat_df[c] = flat_df[x_cols].sum(axis=1)/ flat_df["crop_yield"]
-
-
-# Calculate total elements ratio over yield
-flat_df["ferti_inefficiency"] = flat_df[new_cols].sum(axis=1)
-
-# Calculate hours of machinery use per hectare relative to yield
-flat_df["hours_of_machines_inefficiency"] = (
-		flat_df["hours_of_machines_ha"] / flat_df["crop_yield"]
-)
+# normalized values (per quintal), pesticides per hectare and their ratio over the yield,
+# nutrients over the yield, hours of machines over the yield: the cleaned crop_yield above
+# is used
+flat_df = add_features(flat_df, [
+	'PLV_2_Qt', 'phyto_costs_2_Qt', 'fert_costs_2_Qt',
+	'herbicide_ha', 'insecticide_ha', 'fungicide_ha',
+	'herbicide_inefficiency', 'insecticide_inefficiency', 'fungicide_inefficiency', 'phyto_inefficiency',
+	'N_ha', 'P_ha', 'K_ha', 'ferti_inefficiency',
+	'hours_of_machines_inefficiency',
+])
 
 
 ## ===================== FILTERING ===========================
-from DB_population.flat_utils  import remove_outliers_adjusted_boxplot
-import gc
+from DB_population.flat_utils  import remove_outliers_parallel
 
 # BEFORE CLEANING:  Let see some numbers about the size of flat_df
 from matplotlib import pyplot as plt
 cols = flat_df.columns[3::]
 sel_cols =[]
-Mat = []
 from scipy.stats import skew
 for c in cols:
     temp = flat_df[c]
     data_skew = skew(temp.dropna())
     if abs(data_skew) > 0.2:
          sel_cols.append(c)
-    Mat.append(temp[temp>0])
 
-plt.boxplot(Mat,labels = cols)
-plt.xticks(rotation = 90)
-plt.tight_layout()
+# the distributions of each crop
+Mat = {}
+for sp in species:
+    Mat[sp] = []
+    for c in cols:
+        temp = flat_df.loc[flat_df['species'] == sp, c]
+        Mat[sp].append(temp[temp>0])
+
+    plt.figure(f'{sp} before cleaning')
+    plt.boxplot(Mat[sp],labels = cols)
+    plt.xticks(rotation = 90)
+    plt.title(sp)
+    plt.tight_layout()
 
 # NB phyto_inefficiency' and ferti_inefficiency fa da cappello per tutte le colonne sui fito e fertilizzanti!
 sel_cols=['produced_quantity', 'PLV',
@@ -328,55 +135,28 @@ initial_shape = flat_df.shape
 finited_shape = flat_df.dropna().shape
 
 log1_records = []
-# Per ogni anno
-for year in years:
-    temp = flat_df[flat_df['year'] == year]
-    n_total = temp.shape[0]
-    n_finite = temp.dropna().shape[0]
-    n_farms = len(temp.dropna()['farm code'].unique())
-
-    log1_records.append({
-        "year": year,
-        "n_obs": n_total,
-        "n_finite": n_finite,
-        "n_farms": n_farms,
-    })
+# Per ogni coltura e anno
+for sp in species:
+    for year in years:
+        temp = flat_df[(flat_df['species'] == sp) & (flat_df['year'] == year)]
+        n_total = temp.shape[0]
+        n_finite = temp.dropna().shape[0]
+        n_farms = len(temp.dropna()['farm code'].unique())
+
+        log1_records.append({
+            "species": sp,
+            "year": year,
+            "n_obs": n_total,
+            "n_finite": n_finite,
+            "n_farms": n_farms,
+        })
 log1_rec = pd.DataFrame(log1_records)
 
 # CLEANING DATA AND REPORTETING
-# from sklearn.ensemble import IsolationForest
-
-
-log2_records=[]
-# for batch in range(0, len(cols), 5):
-#     for c in cols[batch:batch+5]:
-for c in sel_cols:
-    print(f"********** Analysing variable {c} ********************")
-
-    temp = flat_df[c].copy()
-    n_obs =  temp.shape[0]
-    n_finite_before =  temp.dropna().shape[0]
-    # iso_forest = IsolationForest(contamination=0.1, random_state=42)
-    # iso_forest.fit(temp.to_numpy().reshape(-1, 1))
-    # # Predizione: -1 = outlier, 1 = normale
-    # outliers = iso_forest.predict(temp.to_numpy().reshape(-1, 1))
-    # print(len(outliers[outliers==-1]))
-       # var= temp.copy()
-    # var[outliers == -1] = np.nan
-    var = remove_outliers_adjusted_boxplot(temp)
-    flat_df[c] = var
-    n_finite_after = var.dropna().shape[0]
-    num_zeri = var.eq(0).sum()
-    gc.collect()
-
-    log2_records.append({
-        "variable": c,
-        "n_obs": n_obs,
-        "n_finite_before": n_finite_before,
-        "n_finite_after": n_finite_after,
-        "n_outliers" : n_finite_before - n_finite_after,
-        "n_zeros": num_zeri
-    })
+# the columns of each crop are cleaned on a pool of WORKERS processes, as many as fit in the
+# available memory (serially where process forking is not available, e.g. Windows and macOS;
+# see flat_utils.remove_outliers_parallel); the result and the log do not depend on their number
+flat_df, log2_records = remove_outliers_parallel(flat_df, sel_cols, by='species', workers=WORKERS)
 log2_rec = pd.DataFrame(log2_records)
 
 # LAST BUT NON LEAST: HANDINGL ZEROS IN AREA AND PLV:
@@ -388,21 +168,23 @@ for c in cols[1:4]:
     flat_df.loc[zero_rows, :] = np.nan
 
 log3_records = []
-# Per ogni anno
-for year in years:
-    temp = flat_df[flat_df['year'] == year]
-    n_total = temp.shape[0]
-    n_finite = temp.dropna().shape[0]
-    n_farms = len(temp.dropna()['farm code'].unique())
-
-    log3_records.append({
-        "year": year,
-        "n_obs": n_total,
-        "n_finite": n_finite,
-        "n_farms": n_farms,
-    })
+# Per ogni coltura e anno
+for sp in species:
+    for year in years:
+        temp = flat_df[(flat_df['species'] == sp) & (flat_df['year'] == year)]
+        n_total = temp.shape[0]
+        n_finite = temp.dropna().shape[0]
+        n_farms = len(temp.dropna()['farm code'].unique())
+
+        log3_records.append({
+            "species": sp,
+            "year": year,
+            "n_obs": n_total,
+            "n_finite": n_finite,
+            "n_farms": n_farms,
+        })
 log3_rec = pd.DataFrame(log3_records)
-log3_rec.insert(loc=2, column='n_finite_before', value=log1_rec['n_finite'])
+log3_rec.insert(loc=3, column='n_finite_before', value=log1_rec['n_finite'])
 log3_rec = log3_rec.drop('n_farms', axis=1)
 log3_rec['n_deletion'] = log3_rec['n_finite_before'] -log3_rec['n_finite']
 # Esportazione in tabella LaTeX
@@ -410,22 +192,25 @@ log3_rec['n_deletion'] = log3_rec['n_finite_before'] -log3_rec['n_finite']
 
 
 
-MatNew = []
+MatNew = {}
 
-for c in cols:
-    temp = flat_df[c]
-    MatNew.append(temp[temp>0])
-
-plt.subplot(1,2,1)
-plt.boxplot(Mat,labels = cols)
-plt.xticks(rotation = 90)
-plt.tight_layout()
-plt.title('before cleaning')
-plt.subplot(1,2,2)
-plt.boxplot(MatNew,labels = cols)
-plt.xticks(rotation = 90)
-plt.tight_layout()
-plt.title('after  cleaning')
+for sp in species:
+    MatNew[sp] = []
+    for c in cols:
+        temp = flat_df.loc[flat_df['species'] == sp, c]
+        MatNew[sp].append(temp[temp>0])
+
+    plt.figure(f'{sp} before and after cleaning')
+    plt.subplot(1,2,1)
+    plt.boxplot(Mat[sp],labels = cols)
+    plt.xticks(rotation = 90)
+    plt.tight_layout()
+    plt.title(f'{sp} before cleaning')
+    plt.subplot(1,2,2)
+    plt.boxplot(MatNew[sp],labels = cols)
+    plt.xticks(rotation = 90)
+    plt.tight_layout()
+    plt.title(f'{sp} after  cleaning')
 
 # np.shape(flat_df)
 # np.shape(flat_df.dropna())
@@ -448,8 +233,10 @@ plt.title('after  cleaning')
 #         flat_df[c]=temp
 #         gc.collect()
 
-# Esportazione in LaTeX
-log3_rec.to_latex("DB_population/tabella_output.tex", index=False, encoding='utf-8')
+# Esportazione in LaTeX (the species column only with several crops, as DB_deliverable.tex
+# includes the table of one crop)
+tabella = log3_rec if len(species) > 1 else log3_rec.drop('species', axis=1)
+tabella.to_latex("DB_population/tabella_output.tex", index=False, escape=True, encoding='utf-8')
 
 !dos2unix DB_population/tabella_output.tex
 
@@ -459,46 +246,54 @@ log3_rec.to_latex("DB_population/tabella_output.tex", index=False, encoding='utf
 ## plots
 
 
+# the pesticides of each crop (Phyto rows: year, farm code, crop, quantity of each class)
 from matplotlib import pyplot as plt
-for T,TYPE in enumerate(types):
-    plt.figure(T+1)
-    mat = Phyto[:, :, T]
-
-    for tox in range(5):
-        vec = []
-        for year in years:
-            ii = np.where(mat[:,0]==year)[0]
-            a = mat[ii,tox+2].astype(float)
-            vec.append(a[a>0])
-        vec = [np.log1p(v) for v in vec]
-        num = [len(v) for v in vec]
-        plt.subplot(2, 3, tox+1)
-        plt.boxplot(vec,patch_artist=True)
-        plt.xticks(np.arange(len(years))+1,years, fontsize=12,rotation = 90)
-        [plt.text(y+1,-1,n) for y,n in zip(years,num)]
-        plt.title(f' Tox {tox+1}')
-        plt.ylim(-2.5,)
-    plt.suptitle(TYPE)
+for k, sp in enumerate(species):
+    for T,TYPE in enumerate(types):
+        plt.figure(f'{TYPE} ({sp})')
+        mat = Phyto[Phyto[:, 2, T] == k, :, T]
+
+        for tox in range(5):
+            vec = []
+            for year in years:
+                ii = np.where(mat[:,0]==year)[0]
+                a = mat[ii,tox+3].astype(float)
+                vec.append(a[a>0])
+            vec = [np.log1p(v) for v in vec]
+            num = [len(v) for v in vec]
+            plt.subplot(2, 3, tox+1)
+            plt.boxplot(vec,patch_artist=True)
+            plt.xticks(np.arange(len(years))+1,years, fontsize=12,rotation = 90)
+            [plt.text(y+1,-1,n) for y,n in zip(years,num)]
+            plt.title(f' Tox {tox+1}')
+            plt.ylim(-2.5,)
+        plt.suptitle(f'{TYPE} ({sp})')
 
 colori =['tab:blue','tab:cyan','tab:olive','tab:orange','tab:red']
 
 
-for T, TYPE in enumerate(types):
-    plt.figure(T + 4)
-    mat = Phyto[:, :, T]
+for k, sp in enumerate(species):
+    for T, TYPE in enumerate(types):
+        plt.figure(f'{TYPE} ({sp}): mean by year')
+        mat = Phyto[Phyto[:, 2, T] == k, :, T]
 
-    for tox in range(5):
-        vec = []
-        for year in years:
-            ii = np.where(mat[:, 0] == year)[0]
-            a = mat[ii, tox + 2].astype(float)
-            vec.append(a[a > 0])
-        vec = [np.mean(v) for v in vec]
-        plt.plot(years,vec,'-o',color=colori[tox],label=f'TOX {tox}')
-        plt.xticks(years, years, fontsize=12, rotation=90)
-    plt.legend()
-    plt.title(TYPE)
+        for tox in range(5):
+            vec = []
+            for year in years:
+                ii = np.where(mat[:, 0] == year)[0]
+                a = mat[ii, tox + 3].astype(float)
+                vec.append(a[a > 0])
+            vec = [np.mean(v) for v in vec]
+            plt.plot(years,vec,'-o',color=colori[tox],label=f'TOX {tox}')
+            plt.xticks(years, years, fontsize=12, rotation=90)
+        plt.legend()
+        plt.title(f'{TYPE} ({sp})')
 
 
 flat_df.to_csv("DB_population/flat_df.csv", index=False)
+# also partitioned by year and species, read with parquet_utils.read_flat_parquet
+try:
+    write_flat_parquet(flat_df, "DB_population/flat_df_parquet")
+except ImportError:
+    print('pyarrow is not installed: the Parquet flat panel is not written')
 
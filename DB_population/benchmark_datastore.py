@@ -0,0 +1,189 @@
+"""
+Benchmark of the datastore builders in db_utils.py against the farm-by-farm loops
+they replace. Each stage is timed on the RICA data in '1_DB_population/RICA_DATA'
+and its output is checked to be identical (as JSON) to the loop output.
+
+The loops are the original code of 01_create_json_database.py. The builders differ from
+them on purpose in the following points, each of which is applied to the builder output
+by a named adjustment before the comparison (the number of entries it changes is printed):
+
+- `previous_row_price`: where the produced quantity is 0 the loop keeps the wheat price of
+  the previous crop row (the `wheat_price: np.nan` annotation does not assign), while the
+  builders give nan;
+- `dedented_fertilizers`: the loop writes the fertilizer values after the loop over the
+  types, so only the last type of a crop-year gets its values, the earlier ones being
+  left empty, and a crop-year with fertilizer rows of other types only gets the last
+  values computed for the previous one; the builders fill every type.
+
+The loops also handle the durum and common wheat only, so the builders are run with
+these two crops (LOOP_CROPS) whatever the crops.json registry holds.
+
+The original loops sort the years of a farm with pandas' default sort, which is not
+stable: where a farm has several rows for the same year (e.g. one per species in
+aziende_grano.csv) the row they keep is not defined, while the builders keep the last one
+in file order. These entries are excluded from the comparison, and the builder values are
+checked against the last rows.
+
+Run from the directory used for 01_create_json_database.py.
+"""
+
+import copy
+import json
+import time
+
+import pandas as pd
+
+from DB_population.db_utils import (general_info, general_info_loop, crop_data, crop_data_loop,
+                                    fertilizer_data, fertilizer_data_loop, phyto_data, phyto_data_loop)
+
+n_repeat = 3
+# the crops handled by the original loops
+LOOP_CROPS = {3: 'durum_wheat', 4: 'common_wheat'}
+
+
+def timed(fun, *args):
+    """Return the output of fun(*args) and the best wall time over n_repeat runs"""
+    best = float('inf')
+    for _ in range(n_repeat):
+        t0 = time.perf_counter()
+        out = fun(*args)
+        best = min(best, time.perf_counter() - t0)
+    return out, best
+
+
+def timed_inplace(fun, datastore, *args):
+    """As `timed`, for a stage updating a copy of `datastore` in place (the copy is not timed)"""
+    best = float('inf')
+    for _ in range(n_repeat):
+        out = copy.deepcopy(datastore)
+        t0 = time.perf_counter()
+        fun(out, *args)
+        best = min(best, time.perf_counter() - t0)
+    return out, best
+
+
+def mask_ties(datastore, ties):
+    """Return a copy of `datastore` whose entries at the paths `ties` (tuples of keys) are replaced by 'tie'"""
+    out = copy.deepcopy(datastore)
+    for path in ties:
+        entry = out
+        for key in path[:-1]:
+            entry = entry[key]
+        if path[-1] in entry:
+            entry[path[-1]] = 'tie'
+    return out
+
+
+def previous_row_price(datastore):
+    """
+    Give the crop entries with a zero produced quantity the wheat price of the previous crop
+    row, in the order of the loop (farm, then crop, then year)
+    """
+    out = copy.deepcopy(datastore)
+    n_changed, price = 0, None
+    for farm in out.values():
+        for species in LOOP_CROPS.values():
+            for year in sorted(farm["years"], key=int):
+                entry = farm["years"][year].get(species)
+                if entry is None:
+                    continue
+                if entry["produced_quantity"] == 0:
+                    if price is not None:
+                        entry["wheat_price"] = price
+                        n_changed += 1
+                else:
+                    price = entry["wheat_price"]
+    return out, n_changed
+
+
+def dedented_fertilizers(datastore):
+    """
+    Keep the values of the last fertilizer type of each crop-year only, and give the
+    crop-years without types the last values written before, in the order of the loop
+    (farm, then crop, then year)
+    """
+    out = copy.deepcopy(datastore)
+    n_changed, last = 0, None
+    for farm in out.values():
+        for species in LOOP_CROPS.values():
+            for year in farm["years"]:
+                fertilizers = farm["years"][year].get(species, {}).get("fertilizers")
+                if fertilizers is None:
+                    continue
+                if fertilizers:
+                    names = list(fertilizers)
+                    for name in names[:-1]:
+                        fertilizers[name] = {}
+                    n_changed += len(names) - 1
+                    last = (names[-1], fertilizers[names[-1]])
+                elif last is not None:
+                    fertilizers[last[0]] = copy.deepcopy(last[1])
+                    n_changed += 1
+    return out, n_changed
+
+
+def compare(stage, new, old, ties=(), adjustments=()):
+    for adjust in adjustments:
+        new, n_changed = adjust(new)
+        print(f'{stage}: {adjust.__name__}: {n_changed} entries adjusted')
+    same = json.dumps(mask_ties(new, ties)) == json.dumps(mask_ties(old, ties))
+    print(f'{stage}: identical output: {same}' + (f' ({len(ties)} tied entries excluded)' if ties else ''))
+    if not same:
+        raise AssertionError(f'{stage}: the grouped builder differs from the loop')
+
+
+print("Importing data from aziende_grano.csv, colture_grano.csv, fertilizzanti_grano.csv and fitofarmaci_grano.csv")
+aziende_all = pd.read_csv('1_DB_population/RICA_DATA/aziende_grano.csv', sep=';', decimal=',')
+colture_all = pd.read_csv('1_DB_population/RICA_DATA/colture_grano.csv', sep=';', decimal=',')
+fertilizzanti_all = pd.read_csv('1_DB_population/RICA_DATA/fertilizzanti_grano.csv', sep=';', decimal=',')
+fertilizzanti_all = fertilizzanti_all[fertilizzanti_all['UM'] != 'HL']
+fitofarmaci_all = pd.read_csv('1_DB_population/RICA_DATA/fitofarmaci_grano.csv', sep=';', decimal=',')
+print(f'{aziende_all.shape[0]} rows, {aziende_all["Cod_Azienda"].nunique()} farms')
+
+# ===========================================================================
+# GENERAL INFO
+ds_loop, t_loop = timed(general_info_loop, aziende_all)
+ds_new, t_new = timed(general_info, aziende_all)
+# the farm-years with several rows, and the farm information when it comes from one of them
+tied = aziende_all[aziende_all.duplicated(["Cod_Azienda", "Anno"], keep=False)]
+first_year = aziende_all.groupby("Cod_Azienda")["Anno"].min()
+ties = []
+for code, year in tied[["Cod_Azienda", "Anno"]].drop_duplicates().itertuples(index=False):
+    ties.append((str(code), "years", str(year)))
+    if year == first_year[code]:
+        ties += [(str(code), field) for field in ds_new[str(code)] if field != "years"]
+compare('general info', ds_new, ds_loop, ties)
+for row in tied.drop_duplicates(["Cod_Azienda", "Anno"], keep="last").itertuples(index=False):
+    if ds_new[str(row.Cod_Azienda)]["years"][str(row.Anno)] != {
+            "farm_acreage": float(row.SAU), "standard_gross_output": float(row.Produzione_Standard_Aziendale),
+            "KW_machines": float(row.KW_Macchine)}:
+        raise AssertionError(f'general info: farm {row.Cod_Azienda}, {row.Anno}: not the last row of the year')
+print(f'general info: loop {t_loop:.3f}s - grouped {t_new:.3f}s - speed-up x{t_loop / t_new:.1f}')
+
+# ===========================================================================
+# CROPS (production data and machine hours)
+datastore = ds_new
+ds_loop, t_loop = timed_inplace(crop_data_loop, datastore, colture_all, aziende_all)
+ds_new, t_new = timed_inplace(crop_data, datastore, colture_all, aziende_all, LOOP_CROPS)
+tied = colture_all[colture_all.duplicated(["Cod_Azienda", "Anno", "ID_SPECIE_VEG"], keep=False)
+                   & colture_all["ID_SPECIE_VEG"].isin(list(LOOP_CROPS))]
+ties = [(str(code), "years", str(year), LOOP_CROPS[crop]) for code, year, crop in
+        tied[["Cod_Azienda", "Anno", "ID_SPECIE_VEG"]].drop_duplicates().itertuples(index=False)]
+compare('crops', ds_new, ds_loop, ties, adjustments=(previous_row_price,))
+print(f'crops: loop {t_loop:.3f}s - grouped {t_new:.3f}s - speed-up x{t_loop / t_new:.1f}')
+
+# ===========================================================================
+# FERTILIZERS
+datastore = ds_new
+ds_loop, t_loop = timed_inplace(fertilizer_data_loop, datastore, fertilizzanti_all)
+ds_new, t_new = timed_inplace(fertilizer_data, datastore, fertilizzanti_all, LOOP_CROPS)
+compare('fertilizers', ds_new, ds_loop, adjustments=(dedented_fertilizers,))
+print(f'fertilizers: loop {t_loop:.3f}s - grouped {t_new:.3f}s - speed-up x{t_loop / t_new:.1f}')
+
+# ===========================================================================
+# PESTICIDES
+datastore = ds_new
+ds_loop, t_loop = timed_inplace(phyto_data_loop, datastore, fitofarmaci_all)
+ds_new, t_new = timed_inplace(phyto_data, datastore, fitofarmaci_all, LOOP_CROPS)
+compare('pesticides', ds_new, ds_loop)
+print(f'pesticides: loop {t_loop:.3f}s - grouped {t_new:.3f}s - speed-up x{t_loop / t_new:.1f}')
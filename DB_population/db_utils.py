@@ -0,0 +1,845 @@
+"""
+A library for building the ECOWHEATALY JSON database from the RICA tables
+"""
+
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+OTE = np.array([
+    'Aziende con poliallevamento',
+    'Aziende con policoltura',
+    'Aziende miste coltivazioni ed allevamenti',
+    'Aziende specializzate in erbivori',
+    'Aziende specializzate in granivori',
+    'Aziende specializzate in ortofloricoltura',
+    'Aziende specializzate nei seminativi',
+    'Aziende specializzate nelle coltivazioni permanenti'])
+
+TEO = np.array([
+    'polybreeding',
+    'polyculture',
+    'mixed_cultivation_and_breeding',
+    'herbivores',
+    'granivores',
+    'horticulture',
+    'arable_crops',
+    'permanent_crops'])
+
+# the crop registry: a JSON file mapping the RICA species codes to the crop names used in the datastore
+CROP_REGISTRY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'crops.json')
+
+
+def load_crop_registry(path=CROP_REGISTRY):
+    """
+    Read a crop registry.
+
+    Parameters
+    ----------
+    path : str
+        A JSON file {species code: crop name}, e.g. {"3": "durum_wheat"}.
+
+    Returns
+    -------
+    dict
+        {species code (int): crop name}, in the order of the file.
+    """
+    with open(path) as f:
+        return {int(code): name for code, name in json.load(f).items()}
+
+
+# the crops imported in the datastore: {ID_SPECIE_VEG: crop name}
+CROPS = load_crop_registry()
+
+# the fertilizers and pesticides imported in the datastore: {Produzione_Industriale: type}
+FERT_TYPES = {
+    'Concimi minerali solidi': 'Mineral',
+    'Concimi organo minerali solidi': 'OrganoMineral',
+    'Altri concimi e fertilizzanti': 'Other',
+    'Concimi a base di microelementi solidi': 'Micro_Mineral',
+}
+
+PHYTO_TYPES = {
+    'Diserbante': 'Herbicide',
+    'Insetticida': 'Insecticide',
+    'Anticrittogamico': 'Fungicide',
+}
+
+# pesticide categories and toxicity classes of the Biosphere3 exchanges (see task1_2/scripts/4_lca.py)
+PHYTO_CATEGORIES = {
+    "Fungicide": ["Anticrittogamico"],
+    "Acaricide": ["Acaricida"],
+    "Herbicide": ["Diserbante"],
+    "Insecticide": ["Insetticida"],
+    "GrowthRegulator": ["Fitoregolatore"],
+    "Molluscicide": ["Molluschicida", "Nematocida", "Rodenticida"]  # Unified as Molluscicide
+}
+
+TOXICITY_LABELS = {
+    0: "Caution",
+    1: "Very_Toxic",
+    2: "Toxic",
+    3: "Harmful",
+    4: "Irritating"
+}
+
+# only these (category, toxicity) combinations are matched in Biosphere3
+FITO_BIOSPHERE_EXCHANGES = {
+    "Fungicide_harmful": ("Fungicide", "Harmful"),
+    "Herbicide_caution": ("Herbicide", "Caution"),
+    "Herbicide_irritating": ("Herbicide", "Irritating"),
+    "Herbicide_harmful": ("Herbicide", "Harmful"),
+    "GrowthRegulator_harmful": ("GrowthRegulator", "Harmful"),
+    "Insecticide_harmful": ("Insecticide", "Harmful"),
+    "Insecticide_toxic": ("Insecticide", "Toxic"),
+    "Molluscicide_irritating": ("Molluscicide", "Irritating")
+}
+
+# y =  cost_of_own_machines + (contoterzismo /(costi opportunità)(1+0.3))
+THIRD_PARTY_MACHINE_MAKEUP = 0.3
+
+
+def _farm_blocks(farm_codes):
+    """
+    Group the rows of a table by farm with one stable sort.
+
+    Returns the sorting indexer and the start/end positions (in the sorted order)
+    of the block of each farm; farms appear in order of first appearance.
+    """
+    farm_rank = pd.factorize(farm_codes)[0]
+    order = np.argsort(farm_rank, kind="stable")
+    starts = np.flatnonzero(np.r_[True, np.diff(farm_rank[order]) != 0])
+    ends = np.r_[starts[1:], len(order)]
+    return order, starts, ends
+
+
+def general_info(aziende_all):
+    """
+    Build the farm level part of the datastore with a single pass over `aziende_all`.
+
+    Rows are grouped by farm (in order of first appearance) with one stable sort, then
+    each farm block is stably ordered by year: the first row gives the farm information
+    and, when a year is repeated (e.g. one row per species), the last row of the year in
+    file order gives the yearly values. Being stable, the result does not depend on which
+    years are processed together (see `update_datastore`). It is the output of
+    `general_info_loop` apart from the repeated years, whose row the loop (not stable)
+    leaves undefined.
+
+    Parameters
+    ----------
+    aziende_all : pd.DataFrame
+        The content of aziende_grano.csv.
+
+    Returns
+    -------
+    dict
+        The datastore: {farm code (str): {"region": ..., ..., "years": {year (str): {...}}}}
+    """
+    order, starts, ends = _farm_blocks(aziende_all["Cod_Azienda"])
+    cols = ["Cod_Azienda", "Anno", "Regione", "Provincia", "Regione_Agraria", "Zona_Altimetrica_3",
+            "PoloOTE", "Genere", "Giovane", "SAU", "Produzione_Standard_Aziendale", "KW_Macchine"]
+    v = {c: aziende_all[c].to_numpy()[order] for c in cols}
+    teo = {ote: t for ote, t in zip(OTE, TEO)}
+
+    datastore = {}
+    for s, e in zip(starts, ends):
+        block = s + np.argsort(v["Anno"][s:e], kind="stable")
+        first = block[0]
+        years = {}
+        for r in block:
+            years[str(v["Anno"][r])] = {
+                "farm_acreage": float(v["SAU"][r]),
+                "standard_gross_output": float(v["Produzione_Standard_Aziendale"][r]),
+                "KW_machines": float(v["KW_Macchine"][r])}
+        datastore[str(v["Cod_Azienda"][first])] = {
+            "region": v["Regione"][first],
+            "province": v["Provincia"][first],
+            "agronomic_region": v["Regione_Agraria"][first],
+            "Zona_Altimetrica": v["Zona_Altimetrica_3"][first],
+            "technical-economic_orientation": teo[v["PoloOTE"][first]],
+            "gender": v["Genere"][first],
+            "is_youth": v["Giovane"][first],
+            "years": years,
+        }
+    return datastore
+
+
+def machine_hours(colture_all, aziende_all, makeup=THIRD_PARTY_MACHINE_MAKEUP):
+    """
+    Compute the machine hours of every row of `colture_all` at once.
+
+    The hours of rented machines are the third-party costs ("Contoterzismo") divided by
+    the hourly opportunity costs of labour and machines (from `aziende_all`) increased by
+    `makeup`. The opportunity costs are joined on (Cod_Azienda, Anno, ID_SPECIE_VEG):
+    rows with no match get 0 hours, rows with several matches get the mean, and these
+    last ones are reported in a single table.
+
+    Parameters
+    ----------
+    colture_all : pd.DataFrame
+        The content of colture_grano.csv.
+    aziende_all : pd.DataFrame
+        The content of aziende_grano.csv.
+    makeup : float
+        The makeup of third-party machine services over the opportunity costs.
+
+    Returns
+    -------
+    pd.DataFrame
+        Indexed as `colture_all`, with columns "hours_of_rent_machines" and
+        "hours_of_machines_ha" (rented plus owned machine hours per hectare).
+    """
+    keys = ["Cod_Azienda", "Anno", "ID_SPECIE_VEG"]
+    rows = colture_all[keys + ["Contoterzismo"]].assign(row=np.arange(colture_all.shape[0]))
+    costs = aziende_all[keys + ["Costo_Opp_Lavoro_Uomo_Orario", "Costo_Opp_Lavoro_Macchina_Orario"]]
+    merged = rows.merge(costs, on=keys, how="inner")
+    merged["hours"] = (merged["Contoterzismo"] / (
+            (merged["Costo_Opp_Lavoro_Uomo_Orario"] + merged["Costo_Opp_Lavoro_Macchina_Orario"]) * (1 + makeup))
+                       ).round(2)
+
+    n_matches = merged.groupby("row").size()
+    multiple = n_matches[n_matches > 1]
+    if len(multiple) > 0:
+        dup = colture_all[keys].iloc[multiple.index].assign(n_matches=multiple.to_numpy())
+        print(f'{len(multiple)} crop rows match multiple rows in aziende_all: '
+              f'their hours of rent machines are averaged')
+        print(dup.to_string(index=False))
+
+    mean_hours = merged.groupby("row")["hours"].mean()
+    hours_of_rent_machines = np.zeros(colture_all.shape[0])
+    hours_of_rent_machines[mean_hours.index] = [round(float(h), 2) for h in mean_hours]
+
+    hours_of_machines_ha = (hours_of_rent_machines + colture_all["Ore_Macchina"].to_numpy()) \
+        / colture_all["SUPERFICIE_UTIL"].to_numpy()
+
+    return pd.DataFrame({"hours_of_rent_machines": hours_of_rent_machines,
+                         "hours_of_machines_ha": np.round(hours_of_machines_ha, 2)},
+                        index=colture_all.index)
+
+
+def crop_data(datastore, colture_all, aziende_all, crops=None):
+    """
+    Add the production data of each crop in the registry to the yearly entries of the datastore.
+
+    The rows of all the crops are handled in one pass over the farm blocks, each block
+    being ordered by crop (in registry order) and year; rows of other species are ignored.
+
+    Parameters
+    ----------
+    datastore : dict
+        The datastore built by `general_info`; it is updated in place.
+    colture_all : pd.DataFrame
+        The content of colture_grano.csv.
+    aziende_all : pd.DataFrame
+        The content of aziende_grano.csv (for the opportunity costs, see `machine_hours`).
+    crops : dict, optional
+        {species code: crop name}; CROPS (the crops.json registry) by default.
+    """
+    crops = CROPS if crops is None else crops
+    colture_all = colture_all[colture_all["ID_SPECIE_VEG"].isin(list(crops))]
+    hours = machine_hours(colture_all, aziende_all)
+    order, starts, ends = _farm_blocks(colture_all["Cod_Azienda"])
+
+    cols = ["Cod_Azienda", "Anno", "ID_SPECIE_VEG", "QT_PROD_PRINC", "PLV", "SUPERFICIE_UTIL", "Concimi",
+            "Difesa", "Energia", "Contoterzismo", "Costo_Lav_Uomo", "Costo_Lav_Macchine"]
+    v = {c: colture_all[c].to_numpy()[order] for c in cols}
+    hours_of_machines_ha = hours["hours_of_machines_ha"].to_numpy()[order]
+    rank = {crop: k for k, crop in enumerate(crops)}
+    crop_rank = np.array([rank[crop] for crop in v["ID_SPECIE_VEG"]], dtype=int)
+
+    for s, e in zip(starts, ends):
+        key = str(v["Cod_Azienda"][s])
+        if key not in datastore:
+            continue
+        block = s + np.lexsort((v["Anno"][s:e], crop_rank[s:e]))
+        for r in block:
+            try:
+                wheat_price = float(v["PLV"][r]) / float(v["QT_PROD_PRINC"][r])
+            except ZeroDivisionError:
+                wheat_price = np.nan
+
+            datastore[key]["years"][str(v["Anno"][r])][crops[v["ID_SPECIE_VEG"][r]]] = {
+                "produced_quantity": float(v["QT_PROD_PRINC"][r]),
+                "PLV": float(v["PLV"][r]),
+                "crop_acreage": float(v["SUPERFICIE_UTIL"][r]),
+                "hours_of_machines_ha": hours_of_machines_ha[r],
+                "fert_costs": float(v["Concimi"][r]),
+                "phyto_costs": float(v["Difesa"][r]),
+                "energy_costs": float(v["Energia"][r]),
+                "thirdy_costs": float(v["Contoterzismo"][r]),
+                "human_costs": float(v["Costo_Lav_Uomo"][r]),
+                "machinery_costs": float(v["Costo_Lav_Macchine"][r]),
+                "wheat_price": round(wheat_price, 2)
+            }
+
+
+def fertilizer_data(datastore, fertilizzanti_all, crops=None):
+    """
+    Add the fertilizers of FERT_TYPES to the crop entries of the datastore.
+
+    The rows are aggregated with one groupby on (farm, year, crop, fertilizer type): the
+    N/P/K rates per hectare are summed (negative sums are rejected and all-zero N/P/K is
+    taken as missing), the fertilized area is averaged and the whole quantity is given per
+    hectare. The nested "fertilizers" entries are then filled from the aggregated frame,
+    with the types in order of first appearance; a farm-year-crop with fertilizer rows of
+    other types only gets an empty entry.
+
+    Parameters
+    ----------
+    datastore : dict
+        The datastore after `crop_data`; it is updated in place.
+    fertilizzanti_all : pd.DataFrame
+        The content of fertilizzanti_grano.csv (without the fertilizers in HL).
+    crops : dict, optional
+        {species code: crop name}; CROPS (the crops.json registry) by default.
+    """
+    keys = ["Cod_Azienda", "Anno", "Cod_Specie_Vegetale"]
+    species = CROPS if crops is None else crops
+    fert = fertilizzanti_all[fertilizzanti_all["Cod_Specie_Vegetale"].isin(list(species))]
+
+    def crop_entry(code, year, crop):
+        farm = datastore.get(str(code))
+        if farm is None or str(year) not in farm["years"]:
+            return None
+        return farm["years"][str(year)][species[crop]]
+
+    for code, year, crop in fert[keys].drop_duplicates().itertuples(index=False):
+        entry = crop_entry(code, year, crop)
+        if entry is not None:
+            entry["fertilizers"] = {}
+
+    fert = fert[fert["Produzione_Industriale"].isin(list(FERT_TYPES))]
+    agg = fert.groupby(keys + ["Produzione_Industriale"], sort=False, observed=True).agg(
+        nitrogen_ha=("Azoto_ad_ettaro", "sum"),
+        phosphorus_ha=("Fosforo_ad_ettaro", "sum"),
+        potassium_ha=("Potassio_ad_ettaro", "sum"),
+        fert_area=("Superficie_della_coltura", "mean"),
+        whole_qt=("Quantità_distribuita", "sum"),
+        unit_cost=("Prezzo_unitario", "mean"),
+        distribuited_value=("Valore_del_distribuito", "mean"),
+    ).reset_index()
+
+    # basic checks: data cannot be negative
+    npk = agg[["nitrogen_ha", "phosphorus_ha", "potassium_ha"]]
+    n_negative = int((npk["nitrogen_ha"] < 0).sum())
+    if n_negative > 0:
+        print(f'removing negative values in fertilizzation rates ({n_negative} nitrogen rates)')
+    npk = npk.mask(npk < 0)
+    # If all the three elements are 0 or nan, we cannot trust!
+    npk.loc[(npk.fillna(0) == 0).all(axis=1)] = np.nan
+    agg[npk.columns] = npk
+    agg["whole_qt_ha"] = agg["whole_qt"] / agg["fert_area"]
+
+    v = {c: agg[c].to_numpy() for c in agg.columns}
+    for r in range(agg.shape[0]):
+        entry = crop_entry(v["Cod_Azienda"][r], v["Anno"][r], v["Cod_Specie_Vegetale"][r])
+        if entry is None:
+            continue
+        entry["fertilizers"][FERT_TYPES[v["Produzione_Industriale"][r]]] = {
+            "fert_area": round(v["fert_area"][r]),
+            "whole_qt_ha": round(v["whole_qt_ha"][r]),
+            "unit_cost": round(v["unit_cost"][r], 2),
+            "distribuited_value": round(v["distribuited_value"][r], 2),
+            "nitrogen_ha": round(v["nitrogen_ha"][r], 2),
+            "phosphorus_ha": round(v["phosphorus_ha"][r], 2),
+            "potassium_ha": round(v["potassium_ha"][r], 2),
+        }
+
+
+def phyto_data(datastore, fitofarmaci_all, crops=None):
+    """
+    Add the pesticides of PHYTO_TYPES to the crop entries of the datastore.
+
+    All the (farm, year, crop, pesticide type, toxicity class) aggregates are computed
+    with one groupby: the quantity per hectare is summed, while area, unit cost and
+    distributed value are averaged. Rows whose ID_SPECIE_VEG differs from
+    Cod_Specie_Vegetale are dropped. The "phytosanitary" entries are then filled from the
+    aggregated frame, sorted by toxicity class, with the types in order of first appearance.
+
+    Parameters
+    ----------
+    datastore : dict
+        The datastore after `crop_data`; it is updated in place.
+    fitofarmaci_all : pd.DataFrame
+        The content of fitofarmaci_grano.csv.
+    crops : dict, optional
+        {species code: crop name}; CROPS (the crops.json registry) by default.
+    """
+    keys = ["Cod_Azienda", "Anno", "Cod_Specie_Vegetale"]
+    species = CROPS if crops is None else crops
+    phyto = fitofarmaci_all[fitofarmaci_all["Cod_Specie_Vegetale"].isin(list(species))
+                            & (fitofarmaci_all["ID_SPECIE_VEG"] == fitofarmaci_all["Cod_Specie_Vegetale"])]
+
+    def crop_entry(code, year, crop):
+        farm = datastore.get(str(code))
+        if farm is None or str(year) not in farm["years"]:
+            return None
+        return farm["years"][str(year)][species[crop]]
+
+    for code, year, crop in phyto[keys].drop_duplicates().itertuples(index=False):
+        entry = crop_entry(code, year, crop)
+        if entry is not None:
+            entry["phytosanitary"] = {}
+
+    phyto = phyto[phyto["Produzione_Industriale"].isin(list(PHYTO_TYPES))]
+    for code, year, crop, i in phyto[keys + ["Produzione_Industriale"]].drop_duplicates().itertuples(index=False):
+        entry = crop_entry(code, year, crop)
+        if entry is not None:
+            entry["phytosanitary"][PHYTO_TYPES[i]] = {}
+
+    # sum the quantity over the same tox class (if any)
+    agg = phyto.groupby(keys + ["Produzione_Industriale", "Classe_di_Tossicità"], observed=True).agg({
+        'Quantità_distribuita_per_Ha': 'sum',
+        'SAU': 'mean',
+        'Prezzo_Unitario': 'mean',
+        'Spesa_Distribuita': 'mean'
+    })
+    index = agg.index.to_frame(index=False)
+    v = {c: index[c].to_numpy() for c in index.columns}
+    values = agg.to_numpy(dtype=float)
+    for r in range(agg.shape[0]):
+        entry = crop_entry(v["Cod_Azienda"][r], v["Anno"][r], v["Cod_Specie_Vegetale"][r])
+        if entry is None:
+            continue
+        entry["phytosanitary"][PHYTO_TYPES[v["Produzione_Industriale"][r]]][int(v["Classe_di_Tossicità"][r])] = {
+            "distributed_quantity_ha": values[r, 0],
+            "phyto_area": values[r, 1],
+            "unit_cost": values[r, 2],
+            "distribuited_value": values[r, 3]
+        }
+
+
+def phyto_coverage(fitofarmaci_all, first_year=2011):
+    """
+    Share of the pesticide rows matched by each of the FITO_BIOSPHERE_EXCHANGES.
+
+    Products are mapped to the PHYTO_CATEGORIES (case-insensitive exact match, "Other"
+    otherwise) and toxicity classes to the TOXICITY_LABELS ("Unknown" otherwise), once per
+    distinct value, and the rows are counted with a single crosstab over
+    species x year x category x toxicity.
+
+    Parameters
+    ----------
+    fitofarmaci_all : pd.DataFrame
+        The content of fitofarmaci_grano.csv.
+    first_year : int
+        Earlier years are ignored (there are no data before 2011).
+
+    Returns
+    -------
+    pd.DataFrame
+        Indexed by (Cod_Specie_Vegetale, Anno), with the number of rows ("n_rows"), the
+        percentage of rows of each exchange and their sum ("matched").
+    """
+    df = fitofarmaci_all.loc[fitofarmaci_all["Anno"] >= first_year,
+                             ["Anno", "Produzione_Industriale", "Cod_Specie_Vegetale", "Classe_di_Tossicità"]]
+    keywords = {kw.strip().lower(): category for category, kws in PHYTO_CATEGORIES.items() for kw in kws}
+    products = pd.unique(df["Produzione_Industriale"])
+    category = df["Produzione_Industriale"].astype(object).map(
+        {p: keywords.get(str(p).strip().lower(), "Other") for p in products}).fillna("Other")
+    toxicity = df["Classe_di_Tossicità"].map(TOXICITY_LABELS).fillna("Unknown")
+
+    counts = pd.crosstab([df["Cod_Specie_Vegetale"], df["Anno"]], [category.rename("Category"),
+                                                                   toxicity.rename("Toxicity")])
+    n_rows = counts.sum(axis=1)
+    report = pd.DataFrame({"n_rows": n_rows})
+    for key, combination in FITO_BIOSPHERE_EXCHANGES.items():
+        matched = counts[combination] if combination in counts.columns else 0
+        report[key] = matched / n_rows * 100
+    report["matched"] = report[list(FITO_BIOSPHERE_EXCHANGES)].sum(axis=1)
+    return report
+
+
+def build_datastore(aziende_all, colture_all, fertilizzanti_all, fitofarmaci_all, crops=None):
+    """
+    Build the whole datastore: general info, crop data, fertilizers and pesticides.
+
+    Parameters
+    ----------
+    aziende_all, colture_all, fertilizzanti_all, fitofarmaci_all : pd.DataFrame
+        The RICA tables.
+    crops : dict, optional
+        {species code: crop name}; CROPS (the crops.json registry) by default.
+
+    Returns
+    -------
+    dict
+        The datastore (see `general_info`).
+    """
+    datastore = general_info(aziende_all)
+    crop_data(datastore, colture_all, aziende_all, crops)
+    fertilizer_data(datastore, fertilizzanti_all, crops)
+    phyto_data(datastore, fitofarmaci_all, crops)
+    return datastore
+
+
+def _build_shard(args):
+    frames, crops = args
+    return build_datastore(*frames, crops=crops)
+
+
+def build_datastore_parallel(aziende_all, colture_all, fertilizzanti_all, fitofarmaci_all, workers, crops=None):
+    """
+    Build the datastore on `workers` processes.
+
+    The work is independent per farm, so the farm codes (in order of first appearance in
+    `aziende_all`) are split into `workers` contiguous shards, every table is split
+    accordingly with a single pass, and the partial datastores built by the processes are
+    merged in shard order. The result is the same as `build_datastore`.
+
+    Processes are forked, so that the calling script is not executed again; where fork is
+    not available (Windows) the datastore is built serially.
+
+    Returns
+    -------
+    dict
+        The datastore (see `general_info`).
+    """
+    if workers <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        if workers > 1: print('process forking is not available: building the datastore serially')
+        return build_datastore(aziende_all, colture_all, fertilizzanti_all, fitofarmaci_all, crops)
+
+    farm_codes = pd.unique(aziende_all["Cod_Azienda"])
+    shard_of = pd.Series(np.arange(len(farm_codes)) * workers // len(farm_codes), index=farm_codes)
+
+    tables = [aziende_all, colture_all, fertilizzanti_all, fitofarmaci_all]
+    split = []
+    for table in tables:
+        shard = table["Cod_Azienda"].map(shard_of)
+        split.append({k: part for k, part in table.groupby(shard, sort=False)})
+    shards = [[split[t].get(k, tables[t].iloc[:0]) for t in range(len(tables))] for k in range(workers)]
+
+    datastore = {}
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+        for partial in pool.map(_build_shard, [(frames, crops) for frames in shards]):
+            datastore.update(partial)
+    return datastore
+
+
+def _farm_order(farm_codes, codes):
+    """
+    Return `farm_codes` in the order of `codes` (the farm codes in order of first
+    appearance); a farm missing in `codes` stays after the farm that precedes it.
+    """
+    rank = {code: k for k, code in enumerate(codes)}
+    keys, last = [], -1
+    for code in farm_codes:
+        last = rank.get(code, last)
+        keys.append(last)
+    return [farm_codes[i] for i in sorted(range(len(farm_codes)), key=keys.__getitem__)]
+
+
+def update_datastore(datastore, aziende_all, colture_all, fertilizzanti_all, fitofarmaci_all, years=None,
+                     workers=1, crops=None):
+    """
+    Add new years to an existing datastore (e.g. the one saved by a previous run).
+
+    Only the rows of the tables whose Anno is in `years` are processed; the resulting
+    farm-year entries (general info, crops, fertilizers and pesticides) are merged into
+    the existing farms, and the years of each farm are kept in chronological order. A year
+    that is already in the datastore is replaced: it is first removed from every farm
+    (a farm left without years is removed). The farms are ordered by first appearance in
+    `aziende_all`, and the farm information is taken from the first year of the farm, as
+    in `general_info`.
+
+    When `aziende_all` holds all the years, the result is the datastore of a full rebuild
+    (same farms, order and content).
+
+    Parameters
+    ----------
+    datastore : dict
+        The existing datastore; it is updated in place.
+    aziende_all, colture_all, fertilizzanti_all, fitofarmaci_all : pd.DataFrame
+        The RICA tables (they may hold the new years only).
+    years : list of int, optional
+        The years to add; by default the years of `aziende_all` missing in the datastore.
+    workers : int
+        Number of processes (see `build_datastore_parallel`).
+    crops : dict, optional
+        {species code: crop name}; CROPS (the crops.json registry) by default.
+
+    Returns
+    -------
+    list of int
+        The years that have been added.
+    """
+    if years is None:
+        existing = {int(y) for farm in datastore.values() for y in farm["years"]}
+        years = sorted(set(aziende_all["Anno"].unique().tolist()) - existing)
+    if len(years) == 0:
+        return []
+
+    tables = [t[t["Anno"].isin(years)] for t in [aziende_all, colture_all, fertilizzanti_all, fitofarmaci_all]]
+    partial = build_datastore_parallel(*tables, workers=workers, crops=crops)
+
+    # the replaced years
+    first_years = {code: min(farm["years"], key=int) for code, farm in datastore.items()}
+    for code, farm in list(datastore.items()):
+        for y in years:
+            farm["years"].pop(str(y), None)
+        if not farm["years"]:
+            del datastore[code]
+
+    for code, farm in partial.items():
+        if code not in datastore:
+            continue
+        old = datastore[code]
+        # the farm information comes from the first year of the farm
+        if min(int(y) for y in farm["years"]) <= min(int(y) for y in old["years"]):
+            old.update({k: v for k, v in farm.items() if k != "years"})
+        merged = {**old["years"], **farm["years"]}
+        old["years"] = {y: merged[y] for y in sorted(merged, key=int)}
+
+    # the farms whose first year has been removed take their information from the next
+    # one, when it is in aziende_all
+    refresh = []
+    for code, farm in datastore.items():
+        first = min(farm["years"], key=int)
+        if first != first_years[code] and first not in partial.get(code, {}).get("years", {}):
+            refresh.append(code)
+    rows = aziende_all[aziende_all["Cod_Azienda"].astype(str).isin(refresh)]
+    for code, farm in (general_info(rows) if len(rows) else {}).items():
+        if min(farm["years"], key=int) == min(datastore[code]["years"], key=int):
+            datastore[code].update({k: v for k, v in farm.items() if k != "years"})
+
+    # the farms in order of first appearance in aziende_all, as in a full rebuild
+    farms = {**datastore, **{code: farm for code, farm in partial.items() if code not in datastore}}
+    order = _farm_order(list(farms), pd.unique(aziende_all["Cod_Azienda"]).astype(str))
+    datastore.clear()
+    datastore.update((code, farms[code]) for code in order)
+    return list(years)
+
+
+def general_info_loop(aziende_all):
+    """
+    Reference implementation of `general_info`: the original loop of
+    01_create_json_database.py, one boolean scan of `aziende_all` per farm.
+
+    It is kept verbatim for benchmarking and for checking the output of `general_info`
+    (see benchmark_datastore.py). Its year sort is not stable, so where a farm has several
+    rows for a year (e.g. one per species) the row it keeps is not defined; `general_info`
+    keeps the last one in file order. The outputs are the same apart from these ties.
+    """
+    farm_codes = aziende_all['Cod_Azienda'].drop_duplicates()
+    datastore = {}
+    for code in farm_codes:
+        tmp_df = aziende_all.loc[aziende_all["Cod_Azienda"] == code].sort_values("Anno")
+        tmp_df.index = range(tmp_df.shape[0])
+        ind = np.isin(OTE, tmp_df.loc[0, "PoloOTE"])
+        teo = TEO[ind]
+        datastore[str(code)] = {
+            "region": tmp_df.loc[0, "Regione"],
+            "province": tmp_df.loc[0, "Provincia"],
+            "agronomic_region": tmp_df.loc[0, "Regione_Agraria"],
+            "Zona_Altimetrica": tmp_df.loc[0, "Zona_Altimetrica_3"],
+            "technical-economic_orientation": teo[0],
+            "gender": tmp_df.loc[0, "Genere"],
+            "is_youth": tmp_df.loc[0, "Giovane"],
+        }
+        datastore[str(code)]["years"] = {}
+        for runner in tmp_df.index:
+            datastore[str(code)]["years"][str(tmp_df.loc[runner, "Anno"])] = {
+                "farm_acreage": float(tmp_df.loc[runner, "SAU"]),
+                "standard_gross_output": float(tmp_df.loc[runner, "Produzione_Standard_Aziendale"]),
+                "KW_machines": float(tmp_df.loc[runner, "KW_Macchine"])}
+    return datastore
+
+
+def crop_data_loop(datastore, colture_all, aziende_all):
+    """
+    Reference implementation of `crop_data` (and `machine_hours`): the original loop of
+    01_create_json_database.py, with boolean scans of `colture_all` per farm and of
+    `aziende_all` per crop row.
+
+    It is kept verbatim for benchmarking and for checking the output of `crop_data` (see
+    benchmark_datastore.py, which lists the intended differences). Its year sort is not
+    stable (see `general_info_loop`).
+    """
+    third_party_machine_makup = THIRD_PARTY_MACHINE_MAKEUP
+    for key in datastore:
+        tmp_df_ = colture_all.loc[colture_all["Cod_Azienda"] == int(key)].sort_values("Anno")
+
+        for crop, species in [(3, 'durum_wheat'), (4, 'common_wheat')]:
+            tmp_df = tmp_df_[tmp_df_["ID_SPECIE_VEG"] == crop].reset_index(drop=True)
+
+            for runner in tmp_df.index:
+                #part 1 - compute machine hours
+                tmp_year = tmp_df.loc[runner, "Anno"]
+                third_party_machine_cost = tmp_df.loc[runner, "Contoterzismo"]
+                opportunity_cost_labor = aziende_all.loc[
+                    (aziende_all['Cod_Azienda'] == int(key)) &
+                    (aziende_all["Anno"] == tmp_year) &
+                    (aziende_all["ID_SPECIE_VEG"] == crop), "Costo_Opp_Lavoro_Uomo_Orario"]
+                opportunity_cost_machine = aziende_all.loc[(aziende_all['Cod_Azienda'] == int(key)) & (aziende_all["Anno"] == tmp_year) & (aziende_all["ID_SPECIE_VEG"] == crop), "Costo_Opp_Lavoro_Macchina_Orario"]
+                computed_hours = round((third_party_machine_cost / ((opportunity_cost_labor + opportunity_cost_machine) * (1 + third_party_machine_makup))), 2)
+
+                if computed_hours.empty:
+                    hours_of_rent_machines = 0.0
+                elif len(computed_hours) == 1:
+                    hours_of_rent_machines = round(float(computed_hours.values[0]), 2)
+                else:
+                    print(
+                        f' ️ key: {key} - runner: {runner} >> multiple values found')
+                    hours_of_rent_machines = round(float(computed_hours.mean()), 2)  # oppure 0.0 o np.nan
+
+                # part 2 - owned machine
+                hours_of_own_machines = tmp_df.loc[runner, "Ore_Macchina"]
+                sau_crop = tmp_df.loc[runner, "SUPERFICIE_UTIL"]
+                hours_of_machines_ha = (hours_of_rent_machines + hours_of_own_machines) / sau_crop
+
+                try:
+                    wheat_price = float(tmp_df.loc[runner, "PLV"]) / float(tmp_df.loc[runner, "QT_PROD_PRINC"])
+                except ZeroDivisionError:
+                    wheat_price: np.nan
+
+                datastore[key]["years"][str(tmp_year)][species] = {
+                    "produced_quantity": float(tmp_df.loc[runner, "QT_PROD_PRINC"]),
+                    "PLV": float(tmp_df.loc[runner, "PLV"]),
+                    "crop_acreage": float(sau_crop),
+                    "hours_of_machines_ha": round(hours_of_machines_ha, 2),
+                    "fert_costs": float(tmp_df.loc[runner, "Concimi"]),
+                    "phyto_costs": float(tmp_df.loc[runner, "Difesa"]),
+                    "energy_costs": float(tmp_df.loc[runner, 'Energia']),
+                    "thirdy_costs": float(tmp_df.loc[runner, 'Contoterzismo']),
+                    "human_costs": float(tmp_df.loc[runner, "Costo_Lav_Uomo"]),
+                    "machinery_costs": float(tmp_df.loc[runner, "Costo_Lav_Macchine"]),
+                    "wheat_price": round(wheat_price, 2)
+                }
+
+
+def fertilizer_data_loop(datastore, fertilizzanti_all):
+    """
+    Reference implementation of `fertilizer_data`: the original loop of
+    01_create_json_database.py, with boolean scans per farm, crop, year and type.
+
+    It is kept verbatim for benchmarking and for checking the output of `fertilizer_data`
+    (see benchmark_datastore.py, which lists the intended differences). Its year sort is
+    not stable (see `general_info_loop`).
+    """
+    tipi = np.array(['Concimi minerali solidi', 'Concimi organo minerali solidi', 'Altri concimi e fertilizzanti','Concimi a base di microelementi solidi'])
+    types = np.array(['Mineral', 'OrganoMineral', 'Other','Micro_Mineral'])
+
+    for key, data in datastore.items():
+        tmp_df_ = fertilizzanti_all[fertilizzanti_all["Cod_Azienda"] == int(key)].sort_values("Anno")
+
+        for crop, species in [(3, 'durum_wheat'), (4, 'common_wheat')]:
+            tmp_df = tmp_df_[tmp_df_["Cod_Specie_Vegetale"] == crop].reset_index(drop=True)
+
+            if tmp_df.shape[0] > 0:
+                for year in data["years"].keys():
+                    tmp_df_y = tmp_df[tmp_df["Anno"] == int(year)].reset_index(drop=True)
+
+                    if tmp_df_y.shape[0] > 0:
+                        datastore[key]["years"][str(year)][species]["fertilizers"] = {}
+
+
+                        for i in tmp_df_y["Produzione_Industriale"].unique():
+                           if i in tipi:
+                                ind = np.isin(tipi,i)
+                                iname = types[ind][0]
+                                datastore[key]["years"][str(year)][species]["fertilizers"][iname] = {}
+                                df_i =  tmp_df_y[tmp_df_y["Produzione_Industriale"] ==i ]
+                                # sum the quantity over the same tox class (if any)
+
+                                azoto_per_ha = df_i["Azoto_ad_ettaro"].sum()
+                                fosforo_per_ha = df_i["Fosforo_ad_ettaro"].sum()
+                                potassio_per_ha = df_i["Potassio_ad_ettaro"].sum()
+
+                                area = df_i["Superficie_della_coltura"].mean()
+                                whole_qt_ha = df_i["Quantità_distribuita"].sum()/area
+
+                                # ---------------------------------------------------------------
+                                # basic checks: data cannot be negative
+                                if azoto_per_ha < 0:
+                                    print(f'removing negative values in fertilizzation rates')
+                                    azoto_per_ha = np.nan
+                                if fosforo_per_ha < 0:
+                                    fosforo_per_ha = np.nan
+                                if potassio_per_ha < 0:
+                                    potassio_per_ha = np.nan
+
+                                # ---------------------------------------------------------------
+                                # If all the three elements are 0 or nan, we cannot trust!
+                                if all(
+                                        (v == 0 or np.isnan(v))
+                                        for v in [azoto_per_ha, potassio_per_ha, fosforo_per_ha]
+                                ):
+                                    azoto_per_ha = np.nan
+                                    potassio_per_ha = np.nan
+                                    fosforo_per_ha = np.nan
+
+                        # ---------------------------------------------------------------
+                        datastore[key]["years"][str(year)][species]["fertilizers"][iname] = {
+                            # "number_of_treatments": n_trattamenti,
+                            "fert_area": round(area),
+                            "whole_qt_ha": round(whole_qt_ha),
+                            "unit_cost": round(df_i["Prezzo_unitario"].mean(),2),
+                            "distribuited_value": round(df_i["Valore_del_distribuito"].mean(), 2),
+                            "nitrogen_ha": round(azoto_per_ha, 2),
+                            "phosphorus_ha": round(fosforo_per_ha, 2),
+                            "potassium_ha": round(potassio_per_ha, 2),
+                        }
+
+
+def phyto_data_loop(datastore, fitofarmaci_all):
+    """
+    Reference implementation of `phyto_data`: the original loop of
+    01_create_json_database.py, with one groupby per farm, crop, year and type.
+
+    It is kept verbatim for benchmarking and for checking the output of `phyto_data`
+    (see benchmark_datastore.py, which lists the intended differences). Its year sort is
+    not stable (see `general_info_loop`).
+    """
+    tipi = np.array(['Diserbante', 'Insetticida', 'Anticrittogamico'])
+    types = np.array(['Herbicide', 'Insecticide', 'Fungicide'])
+
+    for key in datastore:
+        tmp_df_=fitofarmaci_all.loc[fitofarmaci_all["Cod_Azienda"] == int(key)].sort_values("Anno")
+        for crop, species in [(3, 'durum_wheat'), (4, 'common_wheat')]:
+            tmp_df = tmp_df_[tmp_df_["Cod_Specie_Vegetale"] == crop].reset_index(drop=True)
+            # Identifica incoerenze
+            todel= tmp_df[tmp_df['ID_SPECIE_VEG'] != crop].index
+
+            # Elimina le righe
+            tmp_df = tmp_df.drop(todel)
+
+
+            # se ho dati....
+            if tmp_df.shape[0]>0:
+                for year in datastore.get(key)["years"].keys():
+                    # se year è presente...
+                    tmp_df_y = tmp_df.loc[tmp_df["Anno"]==int(year)].reset_index(drop=True)
+                    if tmp_df_y.shape[0]>0:
+                        datastore[key]["years"][str(year)][species]["phytosanitary"] = {}
+                        # let iterate over the pesticides' types
+                        for i in tmp_df_y["Produzione_Industriale"].unique():
+                           if i in tipi:
+                                ind = np.isin(tipi,i)
+                                iname = types[ind][0]
+                                datastore[key]["years"][str(year)][species]["phytosanitary"][iname] = {}
+                                df_i =  tmp_df_y[tmp_df_y["Produzione_Industriale"] ==i ]
+                                # sum the quantity over the same tox class (if any)
+                                val = df_i.groupby('Classe_di_Tossicità').agg({
+                                    'Quantità_distribuita_per_Ha': 'sum',   # Somma i valori della colonna 'Quantità_distribuita_per_Ha'
+                                    'SAU': 'mean',                           # Calcola la media dei valori della colonna 'SAU'
+                                    'Prezzo_Unitario':'mean',
+                                    'Spesa_Distribuita':'mean'
+
+                                    }).reset_index()
+                                # assign the values splitting for tox class
+                                for _, row in val.iterrows():
+
+                                    datastore[key]["years"][str(year)][species]["phytosanitary"][iname][int(row['Classe_di_Tossicità'])] = {}
+                                    datastore[key]["years"][str(year)][species]["phytosanitary"][iname][
+                                        int(row['Classe_di_Tossicità'])] = {
+                                        "distributed_quantity_ha":row['Quantità_distribuita_per_Ha'],
+                                        "phyto_area":row['SAU'],
+                                        "unit_cost":row['Prezzo_Unitario'],
+                                        "distribuited_value" : row['Spesa_Distribuita']
+
+                                    }
@@ -0,0 +1,131 @@
+"""
+A registry of the derived features of the flat panel (flat_df), shared by the scripts
+that compute them (DB_population/02_load_and_organize_flat_df.py, Cindex/01_main.py,
+clustering_AC/clustering_pipeline/featuring_and_clustering_adp.py).
+
+Each feature declares its inputs: columns of the flat panel, other features, or patterns
+('*' wildcards) of columns to sum, e.g. all the herbicide quantities '*Herbicide_Qt*'.
+`add_features` resolves the dependencies of the requested features and computes only
+those missing from the frame, with vectorized operations on whole columns:
+
+    flat_df = add_features(flat_df, ['crop_yield', 'phyto_inefficiency'])
+
+The computed columns are added to the frame (in a single assignment), so that they are
+memoized: a later call on the same frame reuses them, and a column already in the frame
+is taken as it is (e.g. a crop_yield whose zeros have been set to NaN), unless
+recompute=True.
+"""
+
+from fnmatch import fnmatchcase
+from operator import truediv
+
+import pandas as pd
+
+# {feature: (inputs, function of the inputs)}
+FEATURES = {}
+
+PHYTO_TYPES = {'herbicide': 'Herbicide', 'insecticide': 'Insecticide', 'fungicide': 'Fungicide'}
+NUTRIENTS = {'N_ha': 'nitrogen_ha', 'P_ha': 'phosphorus_ha', 'K_ha': 'potassium_ha'}
+COSTS = ['fert_costs', 'phyto_costs', 'human_costs', 'machinery_costs', 'energy_costs', 'thirdy_costs']
+# the cost efficiencies, as named in Cindex: {feature: cost}
+COST_EFFICIENCIES = {'fert_cost_efficiency': 'fert_costs', 'phyto_cost_efficiency': 'phyto_costs',
+                     'human_costs_efficiency': 'human_costs', 'machinery_costs_efficiency': 'machinery_costs',
+                     'energy_costs_efficiency': 'energy_costs', 'thirdy_costs_efficiency': 'thirdy_costs'}
+
+
+def register(name, inputs, fun):
+    """
+    Register the feature `name`.
+
+    Parameters
+    ----------
+    name : str
+        The column of the feature.
+    inputs : list of str
+        Columns, features, or patterns with '*' wildcards.
+    fun : callable
+        Called with one argument per input: a pd.Series for a column or a feature, a
+        pd.DataFrame of the matching columns for a pattern; returns a pd.Series.
+    """
+    FEATURES[name] = (list(inputs), fun)
+
+
+def _row_sum(*columns):
+    """Sum of the columns (pd.Series or pd.DataFrame) by row, NaN being skipped"""
+    frames = [c if isinstance(c, pd.DataFrame) else c.to_frame() for c in columns]
+    return pd.concat(frames, axis=1).sum(axis=1)
+
+
+register('crop_yield', ['produced_quantity', 'crop_acreage'], truediv)
+register('hours_of_machines_inefficiency', ['hours_of_machines_ha', 'crop_yield'], truediv)
+
+# per produced quintal
+for col in ['PLV', 'phyto_costs', 'fert_costs']:
+    register(col + '_2_Qt', [col, 'produced_quantity'], truediv)
+
+# pesticides per hectare and per unit of yield
+for prefix, phyto_type in PHYTO_TYPES.items():
+    register(prefix + '_ha', [f'*{phyto_type}_Qt*', 'crop_acreage'], lambda qt, area: _row_sum(qt) / area)
+    register(prefix + '_inefficiency', [prefix + '_ha', 'crop_yield'], truediv)
+register('phyto_inefficiency', [prefix + '_inefficiency' for prefix in PHYTO_TYPES], _row_sum)
+
+# nutrients (all fertilizer types) per unit of yield
+for name, nutrient in NUTRIENTS.items():
+    register(name, [f'*{nutrient}*', 'crop_yield'], lambda qt, crop_yield: _row_sum(qt) / crop_yield)
+register('ferti_inefficiency', list(NUTRIENTS), _row_sum)
+
+# costs per hectare and per unit of yield
+for cost in COSTS:
+    register(cost + '_ha', [cost, 'crop_acreage'], truediv)
+for name, cost in COST_EFFICIENCIES.items():
+    register(name, [cost + '_ha', 'crop_yield'], truediv)
+
+
+def add_features(df, names, recompute=False):
+    """
+    Add the features `names`, and the features they depend on, missing from `df`.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The flat panel; the new columns are added to it, in dependency order.
+    names : list of str
+        The features (see FEATURES).
+    recompute : bool
+        Compute the features (and the features they depend on) even when they are
+        columns of `df`, which are replaced.
+
+    Returns
+    -------
+    pd.DataFrame
+        `df`.
+    """
+    new = {}
+
+    def column(name):
+        return new[name] if name in new else df[name]
+
+    def resolve(name, path=()):
+        if name in new or name in df.columns and not (recompute and name in FEATURES):
+            return
+        if name not in FEATURES:
+            raise KeyError(f'{name} is neither a column nor a feature')
+        if name in path:
+            raise ValueError(f'circular feature dependency: {" -> ".join(path + (name,))}')
+        inputs, fun = FEATURES[name]
+        args = []
+        for inp in inputs:
+            if '*' in inp:
+                matched = [c for c in list(df.columns) + [c for c in new if c not in df.columns]
+                           if fnmatchcase(c, inp)]
+                args.append(pd.DataFrame({c: column(c) for c in matched}, index=df.index))
+            else:
+                resolve(inp, path + (name,))
+                args.append(column(inp))
+        new[name] = fun(*args)
+
+    for name in names:
+        resolve(name)
+    if new:
+        df[list(new)] = pd.DataFrame(new, index=df.index)
+    return df
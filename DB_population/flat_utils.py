@@ -1,3 +1,8 @@
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 import numpy as np
 from matplotlib import pyplot as plt
@@ -163,25 +168,36 @@ def adjusted_boxplot_outliers_skew_asymmetric(series, k_lower=1.5, k_upper=1.5,
 
     return (series < lower_fence) | (series > upper_fence)
 
-def remove_outliers_adjusted_boxplot(series):
+def outlier_mask(series):
     """
-    Rimuove righe dal DataFrame `df` che contengono outlier in almeno
-    una delle colonne specificate (basato su boxplot aggiustato).
+    Return the outliers of `series` (adjusted boxplot, see
+    adjusted_boxplot_outliers_skew_asymmetric) as a boolean series on its whole index
+    (False for the NaN values, and everywhere when the series is empty or all NaN).
     """
-    # Copia la serie originale
-    result = series.copy()
     # Calcola la maschera degli outlier solo sui valori non NaN
     valid = series.dropna()
     if valid.empty:
-        raise ValueError('series is empty or all NaN')
+        print(f'{series.name}: empty or all NaN, no outliers')
+        return pd.Series(False, index=series.index)
 
-    outlier_mask =  adjusted_boxplot_outliers_skew_asymmetric(valid)
+    outlier_mask = adjusted_boxplot_outliers_skew_asymmetric(valid)
 
     # Reindicizza la maschera per combaciare con la serie originale
     outlier_mask_full = pd.Series(False, index=series.index)
     outlier_mask_full.loc[outlier_mask.index] = outlier_mask
+    return outlier_mask_full
+
+
+def remove_outliers_adjusted_boxplot(series):
+    """
+    Rimuove righe dal DataFrame `df` che contengono outlier in almeno
+    una delle colonne specificate (basato su boxplot aggiustato).
+    """
+    # Copia la serie originale
+    result = series.copy()
+    outlier_mask_full = outlier_mask(series)
 
-    print(f'Found {outlier_mask.sum()} outliers')
+    print(f'Found {outlier_mask_full.sum()} outliers')
     print(f'Data have {series.eq(0).sum()} zeros out of {len(series)}')
 
     # Applica NaN solo sugli outlier, mantenendo la lunghezza
@@ -191,6 +207,135 @@ def remove_outliers_adjusted_boxplot(series):
     return result#df.loc[~outlier_mask].copy()
 
 
+# peak memory of simplified_medcouple per pair of values (bytes): the two float64 n x n
+# grids, the boolean masks and the selected pairs
+MEDCOUPLE_BYTES_PER_PAIR = 48
+
+# share of the available memory in the default budget of the workers (the available memory
+# is a snapshot, and other processes may take part of it meanwhile)
+MEMORY_SAFETY_FRACTION = 0.8
+
+
+def medcouple_memory_mb(n):
+    """Return the estimated peak memory (MB) of the outlier detection on `n` values"""
+    return MEDCOUPLE_BYTES_PER_PAIR * n ** 2 / 2 ** 20
+
+
+def available_memory_mb():
+    """Return the available physical memory (MB), or None where it is not known"""
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def resident_memory_mb():
+    """Return the resident memory of this process (MB), or None where it is not known"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (AttributeError, ValueError, IndexError, OSError):
+        return None
+
+
+def default_memory_budget_mb():
+    """
+    Return the default memory budget of a pool of workers (MB), or None where the available
+    memory is not known: MEMORY_SAFETY_FRACTION of the available memory, less the resident
+    memory of this process, of which the forked workers inherit a copy-on-write image
+    (the pages they write to are copied).
+    """
+    available = available_memory_mb()
+    if available is None:
+        return None
+    return MEMORY_SAFETY_FRACTION * available - (resident_memory_mb() or 0)
+
+
+def _pool_size(workers, n_max, memory_budget_mb):
+    """Return the number of workers (at most `workers`) whose estimated peaks fit the budget together"""
+    if memory_budget_mb is None:
+        memory_budget_mb = default_memory_budget_mb()
+    if memory_budget_mb is None or workers <= 1:
+        return max(1, workers)
+    fit = int(memory_budget_mb // max(medcouple_memory_mb(n_max), 1))
+    if fit < 1:
+        print(f'the largest column needs about {medcouple_memory_mb(n_max):.0f} MB, over the budget '
+              f'of {memory_budget_mb:.0f} MB: running on 1 worker')
+    return max(1, min(workers, fit))
+
+
+def remove_outliers_parallel(df, columns, by=None, workers=1, memory_budget_mb=None):
+    """
+    Remove the outliers of several columns (see remove_outliers_adjusted_boxplot) on a pool
+    of processes.
+
+    The columns (of each group of rows, see `by`) are independent: their outlier masks are
+    computed by the workers, then applied and reported in the order of the groups and of
+    `columns`, so that the result does not depend on the number of workers. The number of
+    workers is limited so that their estimated peaks (medcouple_memory_mb of the largest
+    column) fit the memory budget together.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The data.
+    columns : list of str
+        The columns to clean.
+    by : str, optional
+        A column whose groups of rows (e.g. the crops of "species") are cleaned separately,
+        in order of appearance; all the rows by default.
+    workers : int
+        The number of processes (1 cleans in this process). They are forked, so that the
+        calling script is not executed again; where fork is not available (Windows) or not
+        safe (macOS) the columns are cleaned in this process.
+    memory_budget_mb : float, optional
+        The memory the whole pool may take (MB), shared by the estimated peaks of the
+        workers; by default `default_memory_budget_mb`.
+
+    Returns
+    -------
+    df : pd.DataFrame
+        A copy of `df` with NaN for the outliers.
+    records : list of dict
+        One per group and column: `by` (when given), variable, n_obs, n_finite_before,
+        n_finite_after, n_outliers, n_zeros.
+    """
+    if by is None:
+        groups = [(None, df.index)]
+    else:
+        groups = [(g, df.index[df[by] == g]) for g in pd.unique(df[by].dropna())]
+    tasks = [(g, c, df.loc[rows, c]) for g, rows in groups for c in columns]
+
+    if workers > 1 and ('fork' not in multiprocessing.get_all_start_methods() or sys.platform == 'darwin'):
+        print('process forking is not available: removing the outliers serially')
+        workers = 1
+    workers = _pool_size(workers, max((series.count() for _, _, series in tasks), default=0),
+                         memory_budget_mb)
+    if workers == 1:
+        masks = [outlier_mask(series) for _, _, series in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+            masks = list(pool.map(outlier_mask, [series for _, _, series in tasks]))
+
+    df = df.copy()
+    records = []
+    for (g, c, series), mask in zip(tasks, masks):
+        var = series.mask(mask)
+        df.loc[series.index, c] = var
+        record = {} if by is None else {by: g}
+        record.update({
+            "variable": c,
+            "n_obs": series.shape[0],
+            "n_finite_before": series.count(),
+            "n_finite_after": var.count(),
+            "n_outliers": series.count() - var.count(),
+            "n_zeros": var.eq(0).sum(),
+        })
+        records.append(record)
+        print(f"{c}{'' if by is None else f' ({g})'}: {record['n_outliers']} outliers put as np.nan")
+    return df, records
+
+
 
 def clean_and_plot(df, columns, plot=False, title_prefix=""):
     """
@@ -215,4 +360,136 @@ def clean_and_plot(df, columns, plot=False, title_prefix=""):
         plt.tight_layout()
         plt.show()
 
-    return cleaned_df
\ No newline at end of file
+    return cleaned_df
+
+def flatten_datastore(source, species, years, crop_vars, fert_types, fert_vars, phyto_types, n_tox=5,
+                      dtype=np.float64):
+    """
+    Build the flat panel of one or several crops in a single traversal of the datastore.
+
+    Each farm-year with data on a crop is visited once and gives one row with the
+    general data, the fertilizers and the pesticides of the crop, which replaces the three
+    traversals (general data, fertilizers, pesticides) and the two merges on
+    (year, farm code). The result is the same:
+
+    - the fields missing in the datastore are 0 (general data and fertilizers), except
+      the farm acreage: the farm-years without it are left out of the panel (they are
+      kept in Phyto);
+    - the pesticide quantities (distributed_quantity_ha, summed by toxicity class) are 0
+      without data on a class, and NaN when the crop has no "phytosanitary" entry.
+
+    The values are written in place into typed arrays, not boxed in rows of Python
+    objects. The arrays grow geometrically (their capacity is doubled when full), so that
+    the farm-years need not be counted first: a file or an iterator is read once and
+    streamed, one farm at a time.
+
+    The farm codes must be numeric: as in the panel of 02_load_and_organize_flat_df.py,
+    they are stored as integers, and a ValueError is raised otherwise.
+
+    Parameters
+    ----------
+    source : str, mapping or iterable of (farm code, farm) pairs
+        The datastore or its file (see json_utils.iter_datastore).
+    species : str or list of str
+        The crop, e.g. 'durum_wheat', or the crops (e.g. ['durum_wheat', 'common_wheat'])
+        whose rows are stacked in one panel, told apart by its "species" column.
+    years : list of int
+        The years.
+    crop_vars : list of str
+        The fields of the crop, e.g. ['produced_quantity', 'PLV', ...].
+    fert_types, fert_vars : list of str
+        The fertilizer types and their fields (columns '<type>_<field>').
+    phyto_types : list of str
+        The pesticide types (columns '<type>_Qt Tox-<class>').
+    n_tox : int
+        The number of toxicity classes (0 to n_tox - 1).
+    dtype : np.dtype
+        The dtype of Phyto and of the pesticide columns of `flat_df`, e.g. np.float32 to
+        halve their memory. Phyto also holds the farm codes in this dtype, so a ValueError
+        is raised if one of them cannot be represented exactly (float32 is exact up to 2**24).
+
+    Returns
+    -------
+    flat_df : pd.DataFrame
+        One row per crop and farm-year: the crops in the order of `species`, each in
+        year-major order (farms in datastore order).
+    Phyto : np.ndarray
+        (farm-years with pesticide data, 3 + n_tox, len(phyto_types)) array of the rows
+        [year, farm code, crop (its position in `species`), quantity of each class (NaN
+        without data)] of each type, in the same order.
+    """
+    from DB_population.json_utils import iter_crop_years
+
+    species = [species] if isinstance(species, str) else list(species)
+    crop_index = {name: k for k, name in enumerate(species)}
+
+    def allocate(size):
+        # crop index, year, farm code, general data, fertilizers, pesticides, has acreage, has pesticides
+        return [np.empty(size, dtype=np.int64), np.empty(size, dtype=np.int64), np.empty(size, dtype=np.int64),
+                np.empty((size, 1 + len(crop_vars))), np.empty((size, len(fert_types) * len(fert_vars))),
+                np.full((size, len(phyto_types), n_tox), np.nan, dtype=dtype), np.zeros(size, dtype=bool),
+                np.zeros(size, dtype=bool)]
+
+    arrays = allocate(1024)
+    crop_idx, year, code, general, fert, phyto, has_acreage, has_phyto = arrays
+    n = 0
+    for fid, y, name, farm, farm_year, crop in iter_crop_years(source, species, years):
+        if n == len(crop_idx):
+            grown = allocate(2 * n)
+            for new, old in zip(grown, arrays):
+                new[:n] = old
+            arrays = grown
+            crop_idx, year, code, general, fert, phyto, has_acreage, has_phyto = arrays
+        i = n
+        n += 1
+
+        crop_idx[i] = crop_index[name]
+        year[i] = y
+        if not str(fid).isdigit():
+            raise ValueError(f'farm {fid!r}: the farm codes must be numeric')
+        code[i] = int(fid)
+        has_acreage[i] = 'farm_acreage' in farm_year
+        general[i, 0] = farm_year.get('farm_acreage', np.nan)
+        general[i, 1:] = [crop.get(var, 0) for var in crop_vars]
+
+        fert_data = crop.get('fertilizers', {})
+        fert[i] = [fert_data.get(ftype, {}).get(var, 0) for ftype in fert_types for var in fert_vars]
+
+        phyto_data = crop.get('phytosanitary')
+        if phyto_data is None:
+            continue
+        has_phyto[i] = True
+        for T, ptype in enumerate(phyto_types):
+            val = {}
+            for tox, item in phyto_data.get(ptype, {}).items():
+                val[int(tox)] = val.get(int(tox), 0) + item['distributed_quantity_ha']
+            for tox, qt in val.items():
+                phyto[i, T, tox] = qt
+    crop_idx, year, code, general, fert, phyto, has_acreage, has_phyto = (a[:n] for a in arrays)
+
+    # by crop, in year-major order
+    order = np.lexsort((year, crop_idx))
+    crop_idx, year, code, general, fert, phyto, has_acreage, has_phyto = (
+        a[order] for a in (crop_idx, year, code, general, fert, phyto, has_acreage, has_phyto))
+
+    # the rows of the farm-years with pesticide data: year, farm code, crop, quantities of each type
+    m = int(has_phyto.sum())
+    Phyto = np.empty((m, 3 + n_tox, len(phyto_types)), dtype=dtype)
+    Phyto[:, 0, :] = year[has_phyto, None]
+    Phyto[:, 1, :] = code[has_phyto, None]
+    if np.any(Phyto[:, 1, 0] != code[has_phyto]):
+        raise ValueError(f'the farm codes cannot be represented exactly in {np.dtype(dtype)}')
+    Phyto[:, 2, :] = crop_idx[has_phyto, None]
+    Phyto[:, 3:, :] = phyto[has_phyto].transpose(0, 2, 1)
+
+    # 0 without data on a class (NaN quantities included), NaN without pesticide data
+    phyto_cols = phyto.reshape(n, len(phyto_types) * n_tox)
+    phyto_cols[has_phyto] = np.where(np.isnan(phyto_cols[has_phyto]), 0, phyto_cols[has_phyto])
+    flat_df = pd.concat([
+        pd.DataFrame({'year': year[has_acreage], 'farm code': code[has_acreage],
+                      'species': pd.Series(np.array(species, dtype=object)[crop_idx[has_acreage]], dtype='str')}),
+        pd.DataFrame(general[has_acreage], columns=['farm_acreage'] + crop_vars),
+        pd.DataFrame(fert[has_acreage], columns=[t + '_' + c for t in fert_types for c in fert_vars]),
+        pd.DataFrame(phyto_cols[has_acreage], columns=[t + '_Qt Tox-' + str(k) for t in phyto_types for k in range(n_tox)]),
+    ], axis=1)
+    return flat_df, Phyto
@@ -0,0 +1,391 @@
+"""
+A library for writing and reading the ECOWHEATALY JSON database
+"""
+
+import gzip
+import json
+import mmap
+import os
+from collections.abc import Mapping
+
+
+COMPRESSION_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+
+
+def infer_compression(path):
+    """Return 'gzip', 'zstd' or None from the suffix of `path`"""
+    for compression, suffix in COMPRESSION_SUFFIXES.items():
+        if str(path).endswith(suffix):
+            return compression
+    return None
+
+
+def open_datastore_file(path, mode='rt', compression='infer'):
+    """
+    Open a (possibly compressed) datastore file in text mode.
+
+    Parameters
+    ----------
+    path : str
+        The file.
+    mode : str
+        'rt' or 'wt'.
+    compression : str, optional
+        None, 'gzip' or 'zstd'; by default inferred from the suffix of `path`.
+        zstd needs the standard library `compression.zstd` (Python >= 3.14)
+        or the zstandard package.
+    """
+    if compression == 'infer':
+        compression = infer_compression(path)
+    if compression is None:
+        return open(path, mode, encoding='utf-8')
+    if compression == 'gzip':
+        return gzip.open(path, mode, encoding='utf-8')
+    if compression == 'zstd':
+        try:
+            from compression import zstd
+        except ImportError:
+            import zstandard as zstd
+        return zstd.open(path, mode, encoding='utf-8')
+    raise ValueError(f'unknown compression: {compression}')
+
+
+def _resolve_encoder(encoder):
+    """Resolve 'auto' to 'orjson' when it is installed, otherwise to 'json'"""
+    if encoder != 'auto':
+        return encoder
+    try:
+        import orjson  # noqa: F401
+    except ImportError:
+        return 'json'
+    return 'orjson'
+
+
+def _encoder(encoder, indent):
+    """Return a function encoding one value, with the stdlib json module or orjson"""
+    if encoder == 'orjson':
+        import orjson
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if indent is not None:
+            option |= orjson.OPT_INDENT_2
+        return lambda value: orjson.dumps(value, option=option).decode()
+
+    if encoder != 'json':
+        raise ValueError(f'unknown encoder: {encoder}')
+    if indent is None:
+        return lambda value: json.dumps(value, separators=(',', ':'))
+    return lambda value: json.dumps(value, indent=indent)
+
+
+def write_datastore(datastore, path, indent=4, compression='infer', encoder='json'):
+    """
+    Write the datastore to a JSON file, one farm at a time.
+
+    Only the encoding of a single farm is held in memory. With the default arguments the
+    file is byte-for-byte the one written by json.dump(datastore, f, indent=4).
+
+    Parameters
+    ----------
+    datastore : dict or iterable of (farm code, farm) pairs
+        The datastore.
+    path : str
+        The output file.
+    indent : int, optional
+        Indentation as in json.dump; None writes the compact form (no whitespace).
+    compression : str, optional
+        None, 'gzip' or 'zstd'; by default inferred from the suffix of `path` (.gz, .zst).
+    encoder : str
+        'json' (standard library), 'orjson', or 'auto' to use orjson when installed.
+        orjson is several times faster but writes NaN as null and only indents by 2.
+    """
+    items = datastore.items() if isinstance(datastore, dict) else datastore
+    encoder = _resolve_encoder(encoder)
+    encode = _encoder(encoder, indent)
+    if indent is None:
+        first, sep, key_sep, last = '{', ',', ':', '}'
+    else:
+        pad = '\n' + ' ' * (indent if encoder == 'json' else 2)
+        first, sep, key_sep, last = '{' + pad, ',' + pad, ': ', '\n}'
+
+    with open_datastore_file(path, 'wt', compression) as f:
+        n = 0
+        for code, farm in items:
+            f.write(first if n == 0 else sep)
+            text = encode(farm)
+            if indent is not None:
+                text = text.replace('\n', pad)
+            f.write(json.dumps(str(code)) + key_sep + text)
+            n += 1
+        f.write(last if n > 0 else '{}')
+
+
+def read_datastore(path, compression='infer'):
+    """Load a (possibly compressed) datastore file"""
+    with open_datastore_file(path, 'rt', compression) as f:
+        return json.load(f)
+
+
+def _skip_space(buf, pos):
+    while pos < len(buf) and buf[pos] in ' \t\n\r':
+        pos += 1
+    return pos
+
+
+def stream_datastore(path, compression='infer', chunk_size=2 ** 16):
+    """
+    Yield the (farm code, farm) pairs of a JSON datastore file, parsing it incrementally.
+
+    The file (possibly gzip or zstd compressed, decompressed as it is read) is read in
+    chunks of `chunk_size` characters and each farm is decoded as soon as it is complete,
+    so that memory is bounded by a chunk and a single farm, not by the whole datastore.
+    The farms are the same as those of `read_datastore`.
+
+    Parameters
+    ----------
+    path : str
+        The file, with a JSON object of farms at the top level.
+    compression : str, optional
+        None, 'gzip' or 'zstd'; by default inferred from the suffix of `path`.
+    chunk_size : int
+        The number of characters read at a time.
+    """
+    decoder = json.JSONDecoder()
+    with open_datastore_file(path, 'rt', compression) as f:
+        buf, pos, eof = '', 0, False
+
+        def more():
+            # drop what has been parsed and read the next chunk; False at the end of file
+            nonlocal buf, pos, eof
+            chunk = f.read(chunk_size)
+            buf, pos, eof = buf[pos:] + chunk, 0, not chunk
+            return not eof
+
+        def peek():
+            # skip whitespace and return the next character ('' at the end of file)
+            nonlocal pos
+            while True:
+                pos = _skip_space(buf, pos)
+                if pos < len(buf) or not more():
+                    return buf[pos:pos + 1]
+
+        def expect(chars):
+            # consume the next character, which must be one of `chars`
+            nonlocal pos
+            char = peek()
+            if not char or char not in chars:
+                raise json.JSONDecodeError(f'expecting one of {chars!r}', buf, pos)
+            pos += 1
+            return char
+
+        def value():
+            # decode the next value, reading more chunks until it is complete
+            nonlocal pos
+            while True:
+                peek()
+                try:
+                    obj, end = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    if more():
+                        continue
+                    raise
+                # a number may go on in the next chunk
+                if end == len(buf) and more():
+                    continue
+                pos = end
+                return obj
+
+        expect('{')
+        if peek() == '}':
+            return
+        while True:
+            if peek() != '"':
+                raise json.JSONDecodeError('expecting a farm code', buf, pos)
+            code = value()
+            expect(':')
+            yield code, value()
+            if expect(',}') == '}':
+                return
+
+
+def index_path(path):
+    """Return the path of the farm index of the line-delimited datastore `path`"""
+    return path + '.index.json'
+
+
+def write_datastore_ndjson(datastore, path, encoder='json'):
+    """
+    Write the datastore as line-delimited JSON with a farm index sidecar.
+
+    Each line is the compact encoding of {farm code: farm}. The index, saved next to the
+    file (see `index_path`), maps each farm code to the [offset, length] in bytes of its
+    line, so that a farm can be read without loading the others (see `FarmIndexReader`).
+
+    Parameters
+    ----------
+    datastore : dict or iterable of (farm code, farm) pairs
+        The datastore.
+    path : str
+        The output file (uncompressed, e.g. 'ecowheataly_database.ndjson').
+    encoder : str
+        'json', 'orjson' or 'auto' (see `write_datastore`).
+
+    Returns
+    -------
+    dict
+        The index: {farm code: [offset, length]}.
+    """
+    items = datastore.items() if isinstance(datastore, dict) else datastore
+    encode = _encoder(_resolve_encoder(encoder), None)
+    index = {}
+    offset = 0
+    with open(path, 'wb') as f:
+        for code, farm in items:
+            line = ('{' + json.dumps(str(code)) + ':' + encode(farm) + '}\n').encode('utf-8')
+            f.write(line)
+            index[str(code)] = [offset, len(line) - 1]
+            offset += len(line)
+    with open(index_path(path), 'w') as f:
+        json.dump(index, f)
+    return index
+
+
+class FarmIndexReader:
+    """
+    Random access to the farms of a datastore written by `write_datastore_ndjson`.
+
+    The file is memory-mapped and only the bytes of the requested farms are decoded.
+
+        with FarmIndexReader('1_DB_population/ecowheataly_database.ndjson') as db:
+            farm = db.get_farm('787458')
+
+    Parameters
+    ----------
+    path : str
+        The line-delimited datastore; its index is read from `index_path(path)`.
+    """
+
+    def __init__(self, path):
+        with open(index_path(path)) as f:
+            self.index = json.load(f)
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.index else b''
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, code):
+        return str(code) in self.index
+
+    def codes(self):
+        """Return the farm codes, in file order"""
+        return list(self.index)
+
+    def get_farm(self, code):
+        """Return the farm `code` (a KeyError is raised when it is not in the datastore)"""
+        code = str(code)
+        offset, length = self.index[code]
+        return json.loads(self._map[offset:offset + length])[code]
+
+    def iter_farms(self, codes=None):
+        """Yield the (farm code, farm) pairs of `codes` (all the farms, in file order, by default)"""
+        for code in (self.index if codes is None else codes):
+            yield str(code), self.get_farm(code)
+
+    def close(self):
+        if self._map:
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_datastore(source):
+    """
+    Yield the (farm code, farm) pairs of a datastore.
+
+    Parameters
+    ----------
+    source : str, os.PathLike, mapping or iterable of (farm code, farm) pairs
+        A datastore (e.g. a dict or a schema_utils.DatastoreView), or a file (its path as
+        a str or e.g. a pathlib.Path): a line-delimited one ('.ndjson', read one farm at a time through its index, see
+        `FarmIndexReader`) or a (possibly compressed) JSON one (parsed one farm at a time,
+        see `stream_datastore`).
+    """
+    if isinstance(source, os.PathLike):
+        source = os.fspath(source)
+    if isinstance(source, Mapping):
+        yield from source.items()
+    elif isinstance(source, str) and source.endswith('.ndjson'):
+        with FarmIndexReader(source) as db:
+            yield from db.iter_farms()
+    elif isinstance(source, str):
+        yield from stream_datastore(source)
+    else:
+        yield from source
+
+
+def iter_crop_years(source, species, years=None):
+    """
+    Yield the farm-years with data on any of several crops, in a single traversal.
+
+    Parameters
+    ----------
+    source : str, mapping or iterable of (farm code, farm) pairs
+        The datastore or its file (see `iter_datastore`).
+    species : list of str
+        The crops, e.g. ['durum_wheat', 'common_wheat'].
+    years : list of int, optional
+        Only these years (all by default).
+
+    Yields
+    ------
+    tuple
+        (farm code, year (int), crop name, farm entry, farm-year entry, crop entry), farm
+        by farm, years in datastore order and crops in the order of `species`.
+    """
+    wanted = None if years is None else {str(y) for y in years}
+    for code, farm in iter_datastore(source):
+        for year, farm_year in farm['years'].items():
+            if wanted is not None and year not in wanted:
+                continue
+            for name in species:
+                crop = farm_year.get(name)
+                if crop is not None:
+                    yield code, int(year), name, farm, farm_year, crop
+
+
+def iter_farm_years(source, species, years=None, fields=None, default=0):
+    """
+    Yield the farm-years with data on a crop, in a single traversal of the datastore.
+
+    This replaces the nested lookup data[fid]['years'][year][species] in a try/except
+    KeyError, repeated for every year over all the farms. Records are yielded farm by farm
+    (years in datastore order); sort them by year (stably) for the year-major order.
+
+    Parameters
+    ----------
+    source : str, mapping or iterable of (farm code, farm) pairs
+        The datastore or its file (see `iter_datastore`).
+    species : str
+        The crop, e.g. 'durum_wheat'.
+    years : list of int, optional
+        Only these years (all by default).
+    fields : list of str, optional
+        When given, the crop entry is replaced by the list of these fields of the crop
+        (`default` for the missing ones).
+    default :
+        See `fields`.
+
+    Yields
+    ------
+    tuple
+        (farm code, year (int), farm entry, farm-year entry, crop entry or list of fields)
+    """
+    for code, year, _, farm, farm_year, crop in iter_crop_years(source, [species], years):
+        if fields is not None:
+            crop = [crop.get(f, default) for f in fields]
+        yield code, year, farm, farm_year, crop
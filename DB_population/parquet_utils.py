@@ -0,0 +1,234 @@
+"""
+A library for storing the ECOWHEATALY datastore as normalized Parquet tables.
+
+The datastore is split into five tables, stored in sub-directories of a root directory:
+
+- farms: one row per farm (farm_code, region, province, ...)
+- farm_years: one row per farm and year (farm_acreage, ...), partitioned by year
+- crop_years: one row per farm, year and crop (produced_quantity, PLV, ...)
+- fertilizers: one row per farm, year, crop and fertilizer type
+- phytosanitary: one row per farm, year, crop, pesticide type and toxicity class
+
+the last three being partitioned by year and species, so that a reader can load only the
+partitions (and columns) it needs:
+
+    crops = read_datastore_table('1_DB_population/ecowheataly_parquet', 'crop_years',
+                                 years=[2016], species=['durum_wheat'])
+
+Empty "fertilizers"/"phytosanitary" entries have no rows.
+
+The flat panel (flat_df) is stored in the same way, partitioned by year and species, with
+its dtypes and column order, so that a consumer reads only the years it needs:
+
+    flat_df = read_flat_parquet('DB_population/flat_df_parquet', years=[2016])
+
+Writing needs pyarrow.
+"""
+
+import os
+import shutil
+
+import pandas as pd
+
+
+YEAR_FIELDS = ['farm_acreage', 'standard_gross_output', 'KW_machines']
+FARM_FIELDS = ['region', 'province', 'agronomic_region', 'Zona_Altimetrica', 'technical-economic_orientation',
+               'gender', 'is_youth']
+CROP_FIELDS = ['produced_quantity', 'PLV', 'crop_acreage', 'hours_of_machines_ha', 'fert_costs', 'phyto_costs',
+               'energy_costs', 'thirdy_costs', 'human_costs', 'machinery_costs', 'wheat_price']
+FERT_FIELDS = ['fert_area', 'whole_qt_ha', 'unit_cost', 'distribuited_value', 'nitrogen_ha', 'phosphorus_ha',
+               'potassium_ha']
+PHYTO_FIELDS = ['distributed_quantity_ha', 'phyto_area', 'unit_cost', 'distribuited_value']
+
+# {table: partition columns}
+PARTITIONS = {
+    'farms': None,
+    'farm_years': ['year'],
+    'crop_years': ['year', 'species'],
+    'fertilizers': ['year', 'species'],
+    'phytosanitary': ['year', 'species'],
+}
+
+
+def datastore_tables(datastore):
+    """
+    Normalize the datastore into the five tables.
+
+    Parameters
+    ----------
+    datastore : dict or iterable of (farm code, farm) pairs
+        The datastore.
+
+    Returns
+    -------
+    dict
+        {table name: pd.DataFrame}
+    """
+    items = datastore.items() if isinstance(datastore, dict) else datastore
+    rows = {table: [] for table in PARTITIONS}
+    for code, farm in items:
+        code = str(code)
+        rows['farms'].append([code] + [farm[f] for f in FARM_FIELDS])
+        for year, data in farm['years'].items():
+            year = int(year)
+            rows['farm_years'].append([code, year] + [data[f] for f in YEAR_FIELDS])
+            for species, crop in data.items():
+                if species in YEAR_FIELDS:
+                    continue
+                key = [code, year, species]
+                rows['crop_years'].append(key + [crop[f] for f in CROP_FIELDS])
+                for fert_type, fert in crop.get('fertilizers', {}).items():
+                    rows['fertilizers'].append(key + [fert_type] + [fert[f] for f in FERT_FIELDS])
+                for phyto_type, classes in crop.get('phytosanitary', {}).items():
+                    for tox, phyto in classes.items():
+                        rows['phytosanitary'].append(key + [phyto_type, int(tox)]
+                                                     + [phyto[f] for f in PHYTO_FIELDS])
+
+    keys = ['farm_code', 'year', 'species']
+    columns = {
+        'farms': ['farm_code'] + FARM_FIELDS,
+        'farm_years': ['farm_code', 'year'] + YEAR_FIELDS,
+        'crop_years': keys + CROP_FIELDS,
+        'fertilizers': keys + ['type'] + FERT_FIELDS,
+        'phytosanitary': keys + ['type', 'toxicity'] + PHYTO_FIELDS,
+    }
+    numeric = set(YEAR_FIELDS + CROP_FIELDS + FERT_FIELDS + PHYTO_FIELDS)
+    tables = {}
+    for table, cols in columns.items():
+        df = pd.DataFrame(rows[table], columns=cols)
+        # int fields (e.g. the rounded fertilized area) may be NaN in other rows
+        floats = [c for c in cols if c in numeric]
+        df[floats] = df[floats].astype(float)
+        tables[table] = df
+    tables['phytosanitary']['toxicity'] = tables['phytosanitary']['toxicity'].astype(int)
+    return tables
+
+
+def write_datastore_parquet(datastore, root):
+    """
+    Write the datastore as partitioned Parquet tables (see the module docstring).
+
+    The content of `root` is replaced.
+
+    Parameters
+    ----------
+    datastore : dict or iterable of (farm code, farm) pairs
+        The datastore.
+    root : str
+        The output directory.
+
+    Returns
+    -------
+    dict
+        {table name: number of rows}
+    """
+    tables = datastore_tables(datastore)
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    os.makedirs(root)
+    for table, df in tables.items():
+        path = os.path.join(root, table)
+        if PARTITIONS[table] is None:
+            os.makedirs(path)
+            df.to_parquet(os.path.join(path, 'part-0.parquet'), index=False)
+        else:
+            df.to_parquet(path, index=False, partition_cols=PARTITIONS[table])
+    return {table: df.shape[0] for table, df in tables.items()}
+
+
+def read_datastore_table(root, table, years=None, species=None, columns=None):
+    """
+    Read one table, loading only the partitions of the given years and species.
+
+    Parameters
+    ----------
+    root : str
+        The directory written by `write_datastore_parquet`.
+    table : str
+        'farms', 'farm_years', 'crop_years', 'fertilizers' or 'phytosanitary'.
+    years : list of int, optional
+        Only these years (all by default).
+    species : list of str, optional
+        Only these crops, e.g. ['durum_wheat'] (all by default).
+    columns : list of str, optional
+        Only these columns (all by default).
+
+    Returns
+    -------
+    pd.DataFrame
+        With "year" as int and "species" as str.
+    """
+    partitions = PARTITIONS[table] or []
+    filters = []
+    if years is not None and 'year' in partitions:
+        filters.append(('year', 'in', [int(y) for y in years]))
+    if species is not None and 'species' in partitions:
+        filters.append(('species', 'in', list(species)))
+    df = pd.read_parquet(os.path.join(root, table), columns=columns, filters=filters or None)
+    if 'year' in df.columns:
+        df['year'] = df['year'].astype(int)
+    if 'species' in df.columns:
+        df['species'] = df['species'].astype(str)
+    return df
+
+
+# partition columns of the flat panel
+FLAT_PARTITIONS = ['year', 'species']
+
+
+def write_flat_parquet(flat_df, root):
+    """
+    Write the flat panel (one row per farm-year) as Parquet partitioned by year and species.
+
+    The content of `root` is replaced.
+
+    Parameters
+    ----------
+    flat_df : pd.DataFrame
+        The flat panel, with a "year" column (and a "species" one, if any).
+    root : str
+        The output directory.
+    """
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    partitions = [c for c in FLAT_PARTITIONS if c in flat_df.columns]
+    flat_df.to_parquet(root, index=False, partition_cols=partitions)
+
+
+def read_flat_parquet(root, years=None, species=None, columns=None):
+    """
+    Read the flat panel, loading only the partitions of the given years and species.
+
+    Parameters
+    ----------
+    root : str
+        The directory written by `write_flat_parquet`.
+    years : list of int, optional
+        Only these years (all by default).
+    species : list of str, optional
+        Only these crops (all by default).
+    columns : list of str, optional
+        Only these columns, in this order (all by default, in the order of the panel).
+
+    Returns
+    -------
+    pd.DataFrame
+        With the dtypes of the written panel.
+    """
+    import pyarrow.parquet as pq
+
+    filters = []
+    if years is not None:
+        filters.append(('year', 'in', [int(y) for y in years]))
+    if species is not None:
+        filters.append(('species', 'in', list(species)))
+    df = pd.read_parquet(root, columns=columns, filters=filters or None)
+    meta = pq.ParquetDataset(root).schema.pandas_metadata['columns']
+    if columns is None:
+        # partition columns come last when read
+        df = df[[c['name'] for c in meta if c['name'] in df.columns]]
+    # partition columns are read as categories: restore the written dtypes
+    for c in meta:
+        if c['name'] in FLAT_PARTITIONS and c['name'] in df.columns:
+            df[c['name']] = df[c['name']].astype(c['numpy_type'])
+    return df
@@ -0,0 +1,203 @@
+"""
+Compact in-memory records of the ECOWHEATALY datastore.
+
+In the JSON layout every farm, year, crop, fertilizer and pesticide is a dict keyed by
+strings. Here they are slotted dataclasses (no per-instance __dict__) with the repeated
+strings (regions, provinces, types, ...) interned, which takes a fraction of the memory
+of the nested dicts. The conversion is lossless: `to_datastore(from_datastore(ds))`
+is encoded by json.dump exactly as `ds`.
+
+    farms = from_datastore(read_datastore('1_DB_population/ecowheataly_database.json'))
+    farms[0].years[0].crops[0].fertilizers[0].nitrogen_ha
+"""
+
+import sys
+from dataclasses import dataclass, fields
+from typing import Optional
+
+# the JSON keys that are not valid field names: {field: key}
+FIELD_KEYS = {'technical_economic_orientation': 'technical-economic_orientation'}
+
+
+def _key(field):
+    return FIELD_KEYS.get(field, field)
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+@dataclass(slots=True)
+class FertilizerRecord:
+    """One fertilizer type of a crop-year (an item of "fertilizers")"""
+    type: str
+    fert_area: float
+    whole_qt_ha: float
+    unit_cost: float
+    distribuited_value: float
+    nitrogen_ha: float
+    phosphorus_ha: float
+    potassium_ha: float
+
+
+@dataclass(slots=True)
+class PhytoRecord:
+    """One pesticide type and toxicity class of a crop-year (an item of "phytosanitary")"""
+    type: str
+    toxicity: int
+    distributed_quantity_ha: float
+    phyto_area: float
+    unit_cost: float
+    distribuited_value: float
+
+
+@dataclass(slots=True)
+class CropYear:
+    """
+    The data of a crop in a farm-year.
+
+    `fertilizers` is None when the entry has no "fertilizers" key; `phyto_types` lists the
+    pesticide types of the "phytosanitary" entry in order (None when there is no such key),
+    so that types without any toxicity class are kept.
+    """
+    species: str
+    produced_quantity: float
+    PLV: float
+    crop_acreage: float
+    hours_of_machines_ha: float
+    fert_costs: float
+    phyto_costs: float
+    energy_costs: float
+    thirdy_costs: float
+    human_costs: float
+    machinery_costs: float
+    wheat_price: float
+    fertilizers: Optional[list] = None
+    phyto_types: Optional[list] = None
+    phytosanitary: Optional[list] = None
+
+
+@dataclass(slots=True)
+class FarmYear:
+    """The data of a farm in a year, with its crops"""
+    year: int
+    farm_acreage: float
+    standard_gross_output: float
+    KW_machines: float
+    crops: list
+
+
+@dataclass(slots=True)
+class Farm:
+    """A farm of the datastore, with its years in chronological order"""
+    code: str
+    region: str
+    province: str
+    agronomic_region: str
+    Zona_Altimetrica: str
+    technical_economic_orientation: str
+    gender: str
+    is_youth: str
+    years: list
+
+
+_FERT_FIELDS = [f.name for f in fields(FertilizerRecord)][1:]
+_PHYTO_FIELDS = [f.name for f in fields(PhytoRecord)][2:]
+_CROP_FIELDS = [f.name for f in fields(CropYear)][1:-3]
+_YEAR_FIELDS = [f.name for f in fields(FarmYear)][1:-1]
+_FARM_FIELDS = [f.name for f in fields(Farm)][1:-1]
+
+
+def _crop_from_dict(species, d):
+    crop = CropYear(_intern(species), *[d[f] for f in _CROP_FIELDS])
+    if 'fertilizers' in d:
+        crop.fertilizers = [FertilizerRecord(_intern(t), *[v[f] for f in _FERT_FIELDS])
+                            for t, v in d['fertilizers'].items()]
+    if 'phytosanitary' in d:
+        crop.phyto_types = [_intern(t) for t in d['phytosanitary']]
+        crop.phytosanitary = [PhytoRecord(_intern(t), int(tox), *[v[f] for f in _PHYTO_FIELDS])
+                              for t, classes in d['phytosanitary'].items() for tox, v in classes.items()]
+    return crop
+
+
+def _crop_to_dict(crop):
+    d = {f: getattr(crop, f) for f in _CROP_FIELDS}
+    if crop.fertilizers is not None:
+        d['fertilizers'] = {r.type: {f: getattr(r, f) for f in _FERT_FIELDS} for r in crop.fertilizers}
+    if crop.phyto_types is not None:
+        d['phytosanitary'] = {t: {} for t in crop.phyto_types}
+        for r in crop.phytosanitary:
+            d['phytosanitary'][r.type][r.toxicity] = {f: getattr(r, f) for f in _PHYTO_FIELDS}
+    return d
+
+
+def farm_from_dict(code, farm):
+    """
+    Convert a farm of the datastore to a Farm.
+
+    Parameters
+    ----------
+    code : str
+        The farm code (the datastore key).
+    farm : dict
+        The farm entry of the datastore.
+
+    Returns
+    -------
+    Farm
+    """
+    years = []
+    for year, data in farm['years'].items():
+        crops = [_crop_from_dict(species, d) for species, d in data.items() if species not in _YEAR_FIELDS]
+        years.append(FarmYear(int(year), *[data[f] for f in _YEAR_FIELDS], crops))
+    return Farm(str(code), *[_intern(farm[_key(f)]) for f in _FARM_FIELDS], years)
+
+
+def farm_to_dict(farm):
+    """
+    Convert a Farm to its datastore entry.
+
+    Toxicity classes are int keys, as in the datastore built by db_utils (json.dump
+    writes them as strings).
+
+    Returns
+    -------
+    dict
+    """
+    d = {_key(f): getattr(farm, f) for f in _FARM_FIELDS}
+    d['years'] = {}
+    for year in farm.years:
+        y = {f: getattr(year, f) for f in _YEAR_FIELDS}
+        for crop in year.crops:
+            y[crop.species] = _crop_to_dict(crop)
+        d['years'][str(year.year)] = y
+    return d
+
+
+def from_datastore(datastore):
+    """
+    Convert a datastore to a list of Farm records.
+
+    Parameters
+    ----------
+    datastore : dict or iterable of (farm code, farm) pairs
+        The datastore, e.g. from db_utils.build_datastore or json_utils.read_datastore.
+
+    Returns
+    -------
+    list of Farm
+    """
+    items = datastore.items() if isinstance(datastore, dict) else datastore
+    return [farm_from_dict(code, farm) for code, farm in items]
+
+
+def to_datastore(farms):
+    """
+    Convert Farm records back to the datastore layout.
+
+    Returns
+    -------
+    dict
+        {farm code: farm entry}, which json_utils.write_datastore writes as the original.
+    """
+    return {farm.code: farm_to_dict(farm) for farm in farms}
@@ -0,0 +1,120 @@
+"""
+A library for recording the time and memory used by each stage of a run (e.g. the
+database build) and saving them as a JSON run report
+"""
+
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def peak_rss_mb():
+    """
+    Return the peak resident set size (MB) of this process and of its terminated children
+    (e.g. the workers of a process pool), or None where it is not available.
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 / 2 ** 20 if sys.platform == 'darwin' else 1 / 2 ** 10
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(own, children) * scale, 1)
+
+
+def cpu_time():
+    """Return the CPU time (user + system, s) of this process and of its terminated children"""
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+class RunReport:
+    """
+    Wall time, CPU time and memory of the stages of a run, with counts of the data processed.
+
+    Use `stage` as a context manager around each stage; the record it yields can be given
+    counts (e.g. rows and farms), and the whole report is saved with `write`.
+
+        report = RunReport()
+        with report.stage('load') as st:
+            df = pd.read_csv(...)
+            st['rows'] = df.shape[0]
+        report.write('report.json')
+
+    Parameters
+    ----------
+    trace_memory : bool
+        Also record the peak of the memory allocated by Python (tracemalloc) in each stage.
+        This is exact per stage, unlike the peak RSS which is the peak of the whole run so
+        far, but it slows allocation-heavy code down.
+    **info :
+        Run information to store in the report (e.g. the command line options).
+    """
+
+    def __init__(self, trace_memory=False, **info):
+        self.trace_memory = trace_memory
+        self.info = info
+        self.stages = []
+        self.counts = {}
+        self.started = datetime.datetime.now().isoformat(timespec='seconds')
+        self._t0 = time.perf_counter()
+        self._cpu0 = cpu_time()
+
+    @contextmanager
+    def stage(self, name, verbose=False):
+        """
+        Record the stage `name`.
+
+        Yields
+        ------
+        dict
+            The record of the stage, where counts can be added.
+        """
+        record = {'stage': name}
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        t0 = time.perf_counter()
+        cpu0 = cpu_time()
+        try:
+            yield record
+        finally:
+            record['wall_time_s'] = round(time.perf_counter() - t0, 3)
+            record['cpu_time_s'] = round(cpu_time() - cpu0, 3)
+            record['peak_rss_mb'] = peak_rss_mb()
+            if self.trace_memory:
+                record['tracemalloc_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+            self.stages.append(record)
+            if verbose:
+                print(f"{name}: {record['wall_time_s']:.2f}s wall, {record['cpu_time_s']:.2f}s CPU, "
+                      f"peak RSS {record['peak_rss_mb']} MB")
+
+    def to_dict(self):
+        """Return the report as a dict"""
+        return {
+            'started': self.started,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'info': self.info,
+            'wall_time_s': round(time.perf_counter() - self._t0, 3),
+            'cpu_time_s': round(cpu_time() - self._cpu0, 3),
+            'peak_rss_mb': peak_rss_mb(),
+            'counts': self.counts,
+            'stages': self.stages,
+        }
+
+    def write(self, path):
+        """Save the report to `path` as JSON"""
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=4, default=str)
@@ -0,0 +1,248 @@
+"""
+A library for reading the RICA tables (semicolon separated CSV files with comma decimals)
+"""
+
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """Return the sha256 hex digest of the file at `path`"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# the RICA tables: {name: file name in RICA_DATA}
+RICA_FILES = {
+    'aziende': 'aziende_grano.csv',
+    'colture': 'colture_grano.csv',
+    'fertilizzanti': 'fertilizzanti_grano.csv',
+    'fitofarmaci': 'fitofarmaci_grano.csv',
+    'bilancio': 'bilancio_grano.csv',
+    'certificazioni': 'certificazioni_grano.csv',
+}
+
+# the columns used to build the datastore (None = all the columns)
+RICA_USECOLS = {
+    'aziende': ['Cod_Azienda', 'Anno', 'ID_SPECIE_VEG', 'Regione', 'Provincia', 'Regione_Agraria',
+                'Zona_Altimetrica_3', 'PoloOTE', 'Genere', 'Giovane', 'SAU', 'Produzione_Standard_Aziendale',
+                'KW_Macchine', 'Costo_Opp_Lavoro_Uomo_Orario', 'Costo_Opp_Lavoro_Macchina_Orario'],
+    'colture': ['Cod_Azienda', 'Anno', 'ID_SPECIE_VEG', 'Contoterzismo', 'Ore_Macchina', 'SUPERFICIE_UTIL',
+                'PLV', 'QT_PROD_PRINC', 'Concimi', 'Difesa', 'Energia', 'Costo_Lav_Uomo', 'Costo_Lav_Macchine'],
+    'fertilizzanti': ['Cod_Azienda', 'Anno', 'Cod_Specie_Vegetale', 'Produzione_Industriale', 'UM',
+                      'Prezzo_unitario', 'Valore_del_distribuito', 'Superficie_della_coltura',
+                      'Quantità_distribuita', 'Azoto_ad_ettaro', 'Fosforo_ad_ettaro', 'Potassio_ad_ettaro'],
+    'fitofarmaci': ['Cod_Azienda', 'Anno', 'Cod_Specie_Vegetale', 'ID_SPECIE_VEG', 'Produzione_Industriale',
+                    'Classe_di_Tossicità', 'Quantità_distribuita_per_Ha', 'SAU', 'Prezzo_Unitario',
+                    'Spesa_Distribuita', 'Quantità_distribuita'],
+    'bilancio': None,
+    'certificazioni': None,
+}
+
+# repeated strings that are read as categorical columns
+RICA_CATEGORIES = ['Regione', 'Provincia', 'Regione_Agraria', 'Zona_Altimetrica_3', 'PoloOTE',
+                   'Genere', 'Giovane', 'Produzione_Industriale', 'UM']
+
+
+# the fields read as missing values, by both engines (the pandas.read_csv defaults)
+RICA_NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+                  '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+
+
+def default_engine():
+    """Return 'pyarrow' when pyarrow is installed, otherwise the pandas 'c' parser"""
+    try:
+        import pyarrow.csv  # noqa: F401
+    except ImportError:
+        return 'c'
+    return 'pyarrow'
+
+
+def parse_rica_csv(path, usecols=None, categories=None, engine='c'):
+    """
+    Parse a RICA CSV file.
+
+    The frame does not depend on the engine: the fields in RICA_NA_VALUES (the empty
+    ones included) are missing values in every column, and the `categories` columns are
+    categoricals of strings, with their categories sorted.
+
+    Parameters
+    ----------
+    path : str
+        The CSV file.
+    usecols : list of str, optional
+        Only parse these columns.
+    categories : list of str, optional
+        Columns to return as pandas categoricals (those missing in the file are ignored).
+    engine : str
+        'c' for pandas.read_csv, 'pyarrow' for the multi-threaded pyarrow.csv reader.
+
+    Returns
+    -------
+    pd.DataFrame
+    """
+    if engine == 'pyarrow':
+        import pyarrow as pa
+        from pyarrow import csv
+        table = csv.read_csv(path,
+                             parse_options=csv.ParseOptions(delimiter=';'),
+                             convert_options=csv.ConvertOptions(
+                                 decimal_point=',', include_columns=usecols, null_values=RICA_NA_VALUES,
+                                 strings_can_be_null=True,
+                                 column_types={c: pa.string() for c in (categories or [])}))
+        df = table.to_pandas()
+    else:
+        header = pd.read_csv(path, sep=';', nrows=0).columns
+        dtype = {c: 'str' for c in (categories or []) if c in header}
+        df = pd.read_csv(path, sep=';', decimal=',', usecols=usecols, dtype=dtype, na_values=RICA_NA_VALUES,
+                         keep_default_na=False)
+        if usecols is not None:
+            df = df[list(usecols)]
+    # strings, then categories in sorted order
+    for c in categories or []:
+        if c in df.columns:
+            df[c] = df[c].astype('category')
+    return df
+
+
+def read_rica_csv(path, cache=True, cache_dir=None, verbose=False, usecols=None, categories=None, engine='c'):
+    """
+    Read a RICA CSV file through a Parquet cache.
+
+    The parsed table is stored in `cache_dir` (by default a '.cache' directory next to
+    the CSV file) together with a small JSON file recording the size, modification time
+    and sha256 hash of the source and the dtypes of the parsed columns. The cache entry
+    is keyed by the hash: when size and mtime are unchanged the recorded hash is trusted,
+    otherwise the file is hashed again, so that a touched but unchanged file still hits
+    the cache while an edited one is parsed again. On a hit the columns are cast back to
+    the recorded dtypes, so that the frame is the same as the one from the CSV.
+    Each combination of the parsing options has its own entry.
+
+    Without pyarrow (or fastparquet) the file is simply parsed.
+
+    Parameters
+    ----------
+    path : str
+        The CSV file.
+    cache : bool
+        Set to False to always parse the CSV file.
+    cache_dir : str, optional
+        Where to store the cache entries.
+    verbose : bool
+        Print whether the cache was hit.
+    usecols, categories, engine :
+        Parsing options, see `parse_rica_csv`.
+
+    Returns
+    -------
+    pd.DataFrame
+    """
+    if not cache:
+        return parse_rica_csv(path, usecols, categories, engine)
+
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(path), '.cache')
+    name = os.path.basename(path)
+    meta_path = os.path.join(cache_dir, name + '.json')
+    options = json.dumps({'usecols': usecols, 'categories': categories, 'engine': engine,
+                          'na_values': RICA_NA_VALUES})
+    options_key = hashlib.sha256(options.encode()).hexdigest()[:8]
+
+    stat = os.stat(path)
+    meta = {}
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+
+    if meta.get('size') == stat.st_size and meta.get('mtime_ns') == stat.st_mtime_ns:
+        sha = meta['sha256']
+    else:
+        sha = file_hash(path)
+    loaded = json.dumps(meta)
+    if meta.get('sha256') != sha:
+        # drop the entries of the previous version of the file
+        for entry in meta.get('entries', {}).values():
+            if os.path.exists(os.path.join(cache_dir, entry['data'])):
+                os.remove(os.path.join(cache_dir, entry['data']))
+        meta = {'source': name, 'sha256': sha, 'entries': {}}
+    meta['size'] = stat.st_size
+    meta['mtime_ns'] = stat.st_mtime_ns
+
+    entry = meta['entries'].get(options_key)
+    if entry is not None and os.path.exists(os.path.join(cache_dir, entry['data'])):
+        try:
+            df = pd.read_parquet(os.path.join(cache_dir, entry['data']))
+        except ImportError:
+            return parse_rica_csv(path, usecols, categories, engine)
+        if verbose: print(f'{name}: loaded from cache')
+        if json.dumps(meta) != loaded:
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f, indent=4)
+        return df.astype(entry['dtypes'])
+
+    df = parse_rica_csv(path, usecols, categories, engine)
+    data_name = f'{name}.{sha[:16]}.{options_key}.parquet'
+    os.makedirs(cache_dir, exist_ok=True)
+    try:
+        df.to_parquet(os.path.join(cache_dir, data_name), index=False)
+    except ImportError:
+        if verbose: print(f'{name}: pyarrow is not installed, the parsed table is not cached')
+        return df
+    meta['entries'][options_key] = {'options': json.loads(options),
+                                    'data': data_name,
+                                    'dtypes': {c: str(t) for c, t in df.dtypes.items()}}
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f, indent=4)
+    if verbose: print(f'{name}: parsed and cached')
+    return df
+
+
+def read_rica(data_dir, tables=None, usecols=None, categories=None, engine=None, workers=None,
+              cache=True, verbose=False):
+    """
+    Read the RICA tables concurrently, one thread per file.
+
+    Parameters
+    ----------
+    data_dir : str
+        The RICA_DATA directory.
+    tables : list of str, optional
+        Names of the tables to read (keys of RICA_FILES); all of them by default.
+    usecols : dict, optional
+        {table name: columns to parse}, e.g. RICA_USECOLS; missing tables are fully parsed.
+    categories : list of str, optional
+        Columns to return as categoricals, e.g. RICA_CATEGORIES.
+    engine : str, optional
+        'pyarrow' or 'c'; by default pyarrow when installed (see `default_engine`).
+    workers : int, optional
+        Number of threads; one per table by default.
+    cache, verbose :
+        See `read_rica_csv`.
+
+    Returns
+    -------
+    dict
+        {table name: pd.DataFrame}
+    """
+    if tables is None:
+        tables = list(RICA_FILES)
+    if engine is None:
+        engine = default_engine()
+    usecols = usecols or {}
+
+    def read(table):
+        path = os.path.join(data_dir, RICA_FILES[table])
+        if verbose: print(f"Importing data from {RICA_FILES[table]}")
+        return read_rica_csv(path, cache=cache, verbose=verbose, usecols=usecols.get(table),
+                             categories=categories, engine=engine)
+
+    with ThreadPoolExecutor(max_workers=workers or len(tables)) as pool:
+        frames = list(pool.map(read, tables))
+    return dict(zip(tables, frames))
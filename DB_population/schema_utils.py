@@ -0,0 +1,223 @@
+"""
+A read-only view giving one logical layout over the ECOWHEATALY datastores.
+
+There are two JSON layouts: the English-key one built by DB_population (and its LCA
+variant in clustering_AC), e.g.
+
+    data[farm]['years']['2016']['durum_wheat']['fertilizers']
+
+and the Italian-key one of task1_1 (ecowheataly_database_lca.json), e.g.
+
+    data[farm]['years']['2016']['colture']['Frumento duro']['fertilizzanti']
+
+`DatastoreView` wraps either datastore (as loaded by json.load, nothing is copied) and
+exposes the logical names, those of the English layout: a key is looked up through its
+aliases (ALIASES) at each level, and the nested dicts are wrapped on access. Keys without
+an alias are passed through, so the fields of one layout only remain readable:
+
+    data = DatastoreView(json.load(f))
+    data['123456']['province']                              # 'geo' in the Italian layout
+    data['123456']['years']['2016']['durum_wheat']['crop_acreage']    # 'land_use(ha)'
+
+The two layouts do not hold the same data: the Italian one has the N/P/K totals of a
+crop, the machine hours and one entry per pesticide product, the English one the N/P/K
+per fertilizer type, the machine hours per hectare and the pesticides per toxicity class.
+The view maps the names, not the structure, except for the few fields of DERIVED: when
+a layout lacks one of them, it is computed from the fields it has (e.g. the N/P/K totals
+of an English crop are the sums over its fertilizer types). Fields found in one layout
+only and not derived raise KeyError on the other, e.g. the 5-class altimetric zone
+(Zona_Altimetrica_5) of the Italian layout.
+"""
+
+from collections.abc import Mapping
+
+# the crops of the Italian layout, in year['colture']: {logical name: key}
+ITALIAN_CROPS = {'durum_wheat': 'Frumento duro', 'common_wheat': 'Frumento tenero'}
+
+# {level: {logical key: keys of the layouts, in lookup order}}
+ALIASES = {
+    'farm': {
+        'province': ['province', 'geo'],
+        'Zona_Altimetrica': ['Zona_Altimetrica', 'altimetry', 'zona altimetrica 3'],
+        'Zona_Altimetrica_5': ['Zona_Altimetrica_5', 'zona altimetrica 5'],
+        'n_years_in_farms_file': ['count_in_farms_file(years)'],
+    },
+    'year': {
+        'farm_acreage': ['farm_acreage', 'SAU(ha)'],
+        'standard_gross_output': ['standard_gross_output', 'Produzione_Standard_Aziendale(Euro)'],
+        'KW_machines': ['KW_machines', 'KW_Macchine'],
+    },
+    'crop': {
+        'produced_quantity': ['produced_quantity', 'produced_quantity(ql)'],
+        'crop_acreage': ['crop_acreage', 'land_use(ha)'],
+        'hours_of_own_machines': ['hours of own machines'],
+        'hours_of_rent_machines': ['hours of rent machines'],
+        'cost_of_own_machines_hour': ['cost of own machines per hour'],
+        'fertilizers': ['fertilizers', 'fertilizzanti'],
+        'phytosanitary': ['phytosanitary', 'fitofarmaci'],
+    },
+    'fertilizers': {
+        'n_items': ['numero_items_in_file'],
+        'fert_area': ['fert_area', 'superficie fertilizzata(ha)'],
+        'nitrogen_ha': ['nitrogen_ha', 'azoto a ha(kg)'],
+        'phosphorus_ha': ['phosphorus_ha', 'fosforo a ha(kg)'],
+        'potassium_ha': ['potassium_ha', 'potassio a ha(kg)'],
+    },
+    'phytosanitary': {
+        'n_items': ['numero_items_in_file'],
+        'Herbicide': ['Herbicide', 'Herbicides'],
+        'Insecticide': ['Insecticide', 'Insecticides'],
+        'Coadjuvant': ['Co-adjuvants'],
+    },
+    'phyto_item': {
+        'toxicity': ['classe di tossicit.'],
+        'phyto_area': ['phyto_area', 'superficie trattata(ha)'],
+        'distributed_quantity_ha': ['distributed_quantity_ha', 'quantit. per ha(??)'],
+    },
+}
+
+
+
+def _hours_of_machines_ha(crop):
+    """Hours of own and rent machines per hectare of an Italian crop (an infinite rent is taken as 0)"""
+    rent = crop['hours_of_rent_machines']
+    hours = crop['hours_of_own_machines'] + (0 if rent == float('inf') else rent)
+    return hours / crop['crop_acreage'] if crop['crop_acreage'] > 0 else float('nan')
+
+
+def _n_types(entry):
+    """Number of fertilizer or pesticide types of an English crop"""
+    return sum(isinstance(value, Mapping) for value in entry.values())
+
+
+def _types_total(field):
+    """Sum of `field` over the fertilizer types of an English crop (nan if none has a value)"""
+    def derive(fertilizers):
+        types = [value for value in fertilizers.values() if isinstance(value, Mapping)]
+        if not types:
+            raise KeyError(field)
+        values = [t[field] for t in types if field in t and t[field] == t[field]]
+        return sum(values) if values else float('nan')
+    return derive
+
+
+# fields computed when a layout lacks them: {level: {logical key: function of the view}}
+DERIVED = {
+    'farm': {
+        'n_years_in_farms_file': lambda farm: len(farm['years']),
+    },
+    'crop': {
+        'hours_of_machines_ha': _hours_of_machines_ha,
+    },
+    'fertilizers': {
+        'n_items': _n_types,
+        'nitrogen_ha': _types_total('nitrogen_ha'),
+        'phosphorus_ha': _types_total('phosphorus_ha'),
+        'potassium_ha': _types_total('potassium_ha'),
+    },
+    'phytosanitary': {
+        'n_items': _n_types,
+    },
+}
+
+# the level of the dicts found under a key: {level: {logical key: level}}, '*' for any key
+CHILDREN = {
+    'datastore': {'*': 'farm'},
+    'farm': {'years': 'years'},
+    'years': {'*': 'year'},
+    'year': {'*': 'crop'},
+    'crop': {'fertilizers': 'fertilizers', 'phytosanitary': 'phytosanitary'},
+    'fertilizers': {'*': 'fertilizers'},
+    'phytosanitary': {'*': 'phyto_type'},
+    'phyto_type': {'*': 'phyto_item'},
+}
+
+# {level: {key of a layout: logical key}}
+_LOGICAL = {level: {key: logical for logical, keys in aliases.items() for key in keys}
+            for level, aliases in ALIASES.items()}
+_ITALIAN_CROP_NAMES = {key: logical for logical, key in ITALIAN_CROPS.items()}
+
+
+def detect_schema(datastore):
+    """Return 'italian' or 'english' after the first farm of the datastore (None if empty)"""
+    for farm in datastore.values():
+        for year in farm['years'].values():
+            return 'italian' if 'colture' in year else 'english'
+        return 'italian' if 'geo' in farm else 'english'
+    return None
+
+
+def crop_names(farm_year):
+    """Return the (logical) names of the crops of a farm-year view, in order"""
+    return [key for key in farm_year if key not in ALIASES['year']]
+
+
+class DatastoreView(Mapping):
+    """
+    Logical view of a datastore, or of one of its nested dicts (see the module docstring).
+
+    Parameters
+    ----------
+    data : dict
+        The datastore (or a nested dict).
+    level : str
+        The level of `data`: 'datastore', 'farm', 'years', 'year', 'crop', ...
+    """
+
+    __slots__ = ('data', 'level')
+
+    def __init__(self, data, level='datastore'):
+        self.data = data
+        self.level = level
+
+    def _key(self, key):
+        """Return the key of `data` for the logical `key` (None when missing)"""
+        for k in ALIASES.get(self.level, {}).get(key, [key]):
+            if k in self.data:
+                return k
+        return None
+
+    def _wrap(self, key, value):
+        if not isinstance(value, dict):
+            return value
+        children = CHILDREN.get(self.level, {})
+        level = children.get(key, children.get('*'))
+        return value if level is None else DatastoreView(value, level)
+
+    def __getitem__(self, key):
+        if self.level == 'year' and 'colture' in self.data:
+            crops = self.data['colture']
+            if ITALIAN_CROPS.get(key) in crops:
+                return self._wrap(key, crops[ITALIAN_CROPS[key]])
+            if key in crops:
+                return self._wrap(key, crops[key])
+        k = self._key(key)
+        if k is None:
+            if key in DERIVED.get(self.level, {}):
+                return DERIVED[self.level][key](self)
+            raise KeyError(key)
+        return self._wrap(key, self.data[k])
+
+    def __iter__(self):
+        logical = _LOGICAL.get(self.level, {})
+        for k in self.data:
+            if self.level == 'year' and k == 'colture':
+                for crop in self.data[k]:
+                    yield _ITALIAN_CROP_NAMES.get(crop, crop)
+            else:
+                yield logical.get(k, k)
+
+    def __len__(self):
+        if self.level == 'year' and 'colture' in self.data:
+            return len(self.data) - 1 + len(self.data['colture'])
+        return len(self.data)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __repr__(self):
+        return f'DatastoreView({self.level}, {len(self)} keys)'
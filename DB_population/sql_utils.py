@@ -0,0 +1,123 @@
+"""
+A library for exporting the ECOWHEATALY datastore to SQLite and querying it.
+
+The database holds the normalized tables of parquet_utils.datastore_tables (farms,
+farm_years, crop_years, fertilizers, phytosanitary), indexed on (farm_code, year,
+species) and on the region, province and altimetric zone of the farms, so that slices
+are filtered by the database engine:
+
+    # durum wheat farms in Puglia, hill zone, 2016-2020
+    df = select('1_DB_population/ecowheataly_database.sqlite', 'crop_years', species=['durum_wheat'],
+                years=range(2016, 2021), regions=['Puglia'], zones=['Collina'])
+"""
+
+import os
+import sqlite3
+
+import pandas as pd
+
+from DB_population.parquet_utils import datastore_tables
+
+# SQL column names of the datastore keys that are not valid identifiers
+SQL_COLUMNS = {'technical-economic_orientation': 'technical_economic_orientation'}
+
+INDEXES = {
+    'farms': [['region'], ['province'], ['Zona_Altimetrica']],
+    'farm_years': [['farm_code', 'year'], ['year']],
+    'crop_years': [['farm_code', 'year', 'species'], ['species', 'year']],
+    'fertilizers': [['farm_code', 'year', 'species'], ['species', 'year']],
+    'phytosanitary': [['farm_code', 'year', 'species'], ['species', 'year']],
+}
+
+# filters of `select` on the columns of the farms table: {argument: column}
+FARM_FILTERS = {'farms': 'farm_code', 'regions': 'region', 'provinces': 'province', 'zones': 'Zona_Altimetrica'}
+
+
+def write_datastore_sqlite(datastore, path):
+    """
+    Export the datastore to an SQLite database (an existing file is replaced).
+
+    Parameters
+    ----------
+    datastore : dict or iterable of (farm code, farm) pairs
+        The datastore.
+    path : str
+        The database file.
+
+    Returns
+    -------
+    dict
+        {table name: number of rows}
+    """
+    tables = datastore_tables(datastore)
+    if os.path.exists(path):
+        os.remove(path)
+    with sqlite3.connect(path) as con:
+        for table, df in tables.items():
+            df.rename(columns=SQL_COLUMNS).to_sql(table, con, index=False)
+            for k, cols in enumerate(INDEXES[table]):
+                con.execute(f'CREATE INDEX idx_{table}_{k} ON {table} ({", ".join(cols)})')
+    con.close()
+    return {table: df.shape[0] for table, df in tables.items()}
+
+
+def query(path, sql, params=()):
+    """Run the SQL query `sql` (with `params` for its ? placeholders) and return a DataFrame"""
+    with sqlite3.connect(path) as con:
+        df = pd.read_sql_query(sql, con, params=params)
+    con.close()
+    return df
+
+
+def select(path, table='crop_years', species=None, years=None, columns=None, **farm_filters):
+    """
+    Select the rows of a table for the given crops, years and farms.
+
+    Parameters
+    ----------
+    path : str
+        The database written by `write_datastore_sqlite`.
+    table : str
+        'farm_years', 'crop_years', 'fertilizers' or 'phytosanitary'; its rows are joined
+        with the farms table.
+    species : list of str, optional
+        Only these crops, e.g. ['durum_wheat'] (not for farm_years).
+    years : list of int, optional
+        Only these years.
+    columns : list of str, optional
+        The columns to return (all the columns of the table and of the farms by default).
+    **farm_filters :
+        farms, regions, provinces, zones: lists of farm codes, regions, provinces and
+        altimetric zones (Zona_Altimetrica) to keep.
+
+    Returns
+    -------
+    pd.DataFrame
+        In the order of the datastore.
+    """
+    where, params = [], []
+
+    def isin(column, values):
+        values = list(values)
+        where.append(f'{column} IN ({", ".join("?" * len(values))})')
+        params.extend(values)
+
+    if species is not None:
+        isin('t.species', species)
+    if years is not None:
+        isin('t.year', [int(y) for y in years])
+    for name, values in farm_filters.items():
+        if name not in FARM_FILTERS:
+            raise TypeError(f'unknown filter: {name}')
+        if values is not None:
+            isin(f'f.{FARM_FILTERS[name]}', [str(v) for v in values] if name == 'farms' else values)
+
+    select_cols = ', '.join(columns) if columns is not None else 't.*, ' + ', '.join(
+        f'f.{c}' for c in ['region', 'province', 'agronomic_region', 'Zona_Altimetrica',
+                           'technical_economic_orientation', 'gender', 'is_youth'])
+    sql = f'SELECT {select_cols} FROM {table} t JOIN farms f ON f.farm_code = t.farm_code'
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    # in the order of the datastore
+    sql += ' ORDER BY t.rowid'
+    return query(path, sql, params)
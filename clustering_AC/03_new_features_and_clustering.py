@@ -15,6 +15,7 @@ import matplotlib.pyplot as plt
 
 # from clustering_pipeline import clustering
 from clustering_AC.clustering_pipeline import clustering
+from DB_population.parquet_utils import read_flat_parquet
 
 def _get_cluster_stats(clustered_df: pd.DataFrame):
     
@@ -68,12 +69,9 @@ def main(year: int = 2016):
     if not os.path.exists(output_folder_path):
         os.makedirs(output_folder_path)
     
-    # Step 1: Load data
-    flat_df = pd.read_csv("clustering_AC/clustering_pipeline/data/flat_df.csv")  # Load data into a DataFrame
-    
-    # Filter data for the selected year
+    # Step 1: Load data of the selected year only (its Parquet partition)
     print(f"Filtering year for selected value: {year}")
-    flat_df = flat_df.query(f"year=={year}")
+    flat_df = read_flat_parquet("clustering_AC/clustering_pipeline/data/flat_df_parquet", years=[year])
     
     if flat_df.empty:
         raise Exception(
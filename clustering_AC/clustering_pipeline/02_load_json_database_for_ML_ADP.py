@@ -3,8 +3,14 @@ import json
 import numpy as np
 import pandas as pd
 
+from DB_population.json_utils import iter_farm_years
+from DB_population.parquet_utils import write_flat_parquet
+from DB_population.schema_utils import DatastoreView
+
+# read through the logical view, so that both layouts of the database (e.g. the farm
+# zone as 'altimetry' or 'Zona_Altimetrica') are read the same way
 with open("ecowheataly_database_lca.json") as ewdj:
-  data = json.load(ewdj)
+  data = DatastoreView(json.load(ewdj))
 # SAREBBE DA AGGIUNGERE AL JSON DATABSE:
 # AZIENDE: ' Reddito_Netto','Aiuti_EU','Aiuti_Pubblici_Conto_Capitale','Aiuti_altri'
 
@@ -19,11 +25,6 @@ phy_vars = ['distribuited_quantity','phyto_area']
 years = np.arange(2008,2023)
 species = 'durum_wheat'
 
-farms = []
-for key, val in data.items():
-  # print(key,val)
-    farms.append(key)
-farms = np.array(farms)
 
 ## part 1 -  general data + fertilizers†
 
@@ -64,62 +65,29 @@ farms = np.array(farms)
 # df = pd.DataFrame(Mat,columns=Vars_name)
 # # ------------------------------------------------------------------------------
 
-# -------------- PUT THE SCRIPT INTO A FUNCTION----------------------------
-def extract_data(data, anno, farms, wheat_vars, fert_vars,species='durum_wheat'):
-    columns =['year', 'farm code','farm_acreage',species] + wheat_vars + fert_vars + ['province','altimetry']
-    data_list = []
-
-    for fid in farms:
-        try:
-            farm_acreage = data[fid]['years'][anno]['farm_acreage']
-            crop = data[fid]['years'][anno][species]
-            province = data[fid]['province']
-            altimetric_zone = data[fid]['altimetry']
-            row = [anno, fid,farm_acreage,species]
-
-            # extract data recalled in wheat_vars
-            row.extend(crop.get(key, 0) for key in wheat_vars)
-
-            # extract data recalled in fert_vars
-            fertilizers = crop['fertilizers']
-            row.extend(fertilizers.get(key, 0) for key in fert_vars)
-            row.extend([province,altimetric_zone])
-            data_list.append(row)
-        except KeyError:
-            # Handle KeyError more gracefully, e.g., log the error or return partial data
-            pass
-    # mat = np.array(data_list)
-    # df = pd.DataFrame(data_list, columns=columns)
-    return data_list
-
-# # CHECKS:
-# anno1 = '2011'
-# Vars_name = ['year', 'farm code','farm_acreage','species'] + wheat_vars + fert_vars
-# Mat = extract_data(data, anno1, farms, wheat_vars, fert_vars)
-# df2 = pd.DataFrame(Mat,columns=Vars_name)
-
+# the farm-years with data on `species` are read in a single traversal of the datastore
+# (see DB_population/json_utils.iter_farm_years); rows are then put in year-major order
 Vars_name = ['year', 'farm code','farm_acreage','species'] + wheat_vars + fert_vars + ['province','altimetry']
-years = np.arange(2008,2023)
-for year in years:
-    if year == years[0]:
-        Mat = extract_data(data, str(year), farms, wheat_vars, fert_vars)
-    else:
-        mat = extract_data(data, str(year), farms, wheat_vars, fert_vars)
-        Mat.extend(mat)
-
-
-dtypes = {}
-for i in range(len(Vars_name)):
-    if i <2:
-        dtypes[i] ='int'
-    elif i ==3:
-        dtypes[i] ='str'
-    else:
-        dtypes[i] = 'float'
+Mat = []
+for fid, year, farm, farm_year, crop in iter_farm_years(data, species, years):
+    try:
+        row = [year, fid, farm_year['farm_acreage'], species]
+
+        # extract data recalled in wheat_vars
+        row.extend(crop.get(key, 0) for key in wheat_vars)
+
+        # extract data recalled in fert_vars
+        fertilizers = crop['fertilizers']
+        row.extend(fertilizers.get(key, 0) for key in fert_vars)
+        row.extend([farm['province'], farm['Zona_Altimetrica']])
+    except KeyError:
+        # Handle KeyError more gracefully, e.g., log the error or return partial data
+        continue
+    Mat.append(row)
 
 df1 = pd.DataFrame(Mat,columns=Vars_name)
 dtypes1 = {col: 'int' if i < 2 else 'str' if i == 3 else 'str' if i == 11 else 'str' if i == 12 else 'float' for i, col in enumerate(df1.columns)}
-df1 = df1.astype(dtypes1)
+df1 = df1.astype(dtypes1).sort_values('year', kind='stable', ignore_index=True)
 
 df3 = df1[['year','farm code','province','altimetry']]
 df1.drop(['province','altimetry'],axis='columns',inplace=True)
@@ -134,48 +102,27 @@ df1.drop(['province','altimetry'],axis='columns',inplace=True)
 
 types  =['Herbicide', 'Insecticide', 'Fungicide']
 ColName = ['year','farm code','Qt Tox-0','Qt Tox-1','Qt Tox-2','Qt Tox-3','Qt Tox-4']
-Mat2 = []
-for T,TYPE in enumerate(types):
-    print(f'organizzando {TYPE}')
-    mat = []
-    for year in years:
-        print(year)
-        for i, fid in enumerate(farms):
-            try:
-                # ------------prova 1----------------------------------------
-
-                crop = data[fid]['years'][str(year)][species]
-                row = np.full((7,), np.nan, dtype=object)
-                row[0:2] = [year,np.array(fid, dtype=np.int64)]
-
-                # Estrazione variabili ft
-                phyto = crop['phytosanitary']
-
-                try:
-                    # len(phyto[TYPE]) >=1
-                    val = {}
-                    # for item in phyto[TYPE].values():
-                    #     print(item)
-                    #     classe = item['classe di tossicit.']
-                    #     prodotto = item['superficie trattata(ha)'] * item['quantit. per ha(??)']
-                    #     val[classe] = val.get(classe, 0) + prodotto
-                    for item in phyto[TYPE].keys():
-                        # print(item)
-                        classe=int(item)
-                        item_data = phyto[TYPE][item]
-                        prodotto = item_data['distributed_quantity_ha'] * item_data['phyto_area']
-                        val[classe] = val.get(classe, 0) + prodotto
-                        # print(val)
-                    for c,v in val.items():
-                        row[c+2]= float(v)
-                    mat.append(row)
-                except:
-                    mat.append(row) # year, farm code + 5 nan
-
-
-            except KeyError:
-                pass
-    Mat2.append(mat)
+Mat2 = [[] for TYPE in types]
+for fid, year, farm, farm_year, crop in iter_farm_years(data, species, years):
+    # no row without data on pesticides, year, farm code + 5 nan without data on the type
+    if 'phytosanitary' not in crop:
+        continue
+    phyto = crop['phytosanitary']
+    for T,TYPE in enumerate(types):
+        row = np.full((7,), np.nan, dtype=object)
+        row[0:2] = [year,np.array(fid, dtype=np.int64)]
+        val = {}
+        for item, item_data in phyto.get(TYPE, {}).items():
+            classe=int(item)
+            prodotto = item_data['distributed_quantity_ha'] * item_data['phyto_area']
+            val[classe] = val.get(classe, 0) + prodotto
+        for c,v in val.items():
+            row[c+2]= float(v)
+        Mat2[T].append(row)
+
+# year-major order, as in the plots below
+order = np.argsort([row[0] for row in Mat2[0]], kind='stable')
+Mat2 = [np.array(mat)[order] for mat in Mat2]
 
 # store the data into 3D arrays for plots
 Phyto = np.stack(Mat2,axis=2)
@@ -270,4 +217,9 @@ for T, TYPE in enumerate(types):
 
 
 flat_df.to_csv("data/flat_df.csv", index=False)
+# also partitioned by year and species, read with parquet_utils.read_flat_parquet
+try:
+    write_flat_parquet(flat_df, "data/flat_df_parquet")
+except ImportError:
+    print('pyarrow is not installed: the Parquet flat panel is not written')
 
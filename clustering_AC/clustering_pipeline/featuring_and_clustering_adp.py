@@ -3,6 +3,8 @@
 import json
 from tqdm import tqdm
 from clustering_AC.clustering_pipeline.clustering import *
+from DB_population.feature_utils import add_features
+from DB_population.parquet_utils import read_flat_parquet
 import numpy as np
 import pandas as pd
 from datetime import datetime
@@ -12,85 +14,16 @@ output_folder_path = 'clustering_pipeline/output'
 if not os.path.exists(output_folder_path):
 	os.makedirs(output_folder_path)
 
-# Step 1: Load data
-flat_df = pd.read_csv("DB_population/flat_df.csv")  # Load data into a DataFrame
-
 year = 2016
-# Filter data for the selected year
+
+# Step 1: Load data of the selected year only (its Parquet partition)
 print(f"Filtering year for selected value: {year}")
-flat_df = flat_df.query(f"year=={year}")
+flat_df = read_flat_parquet("DB_population/flat_df_parquet", years=[year])
 
 if flat_df.empty:
 	raise Exception(
 		f"Emtpy DataFram with year {year}. Please, select another value."
 	)
-#
-# # Calculate farm yield as produced quantity per crop acreage
-# flat_df = flat_df.assign(
-# 	farm_yield=lambda x: x.produced_quantity / x.crop_acreage
-# )
-#
-# # Normalize some vslues:
-# flat_df["PLV_2_Qt"] = flat_df['PLV'] / flat_df['produced_quantity']
-#
-#
-# flat_df["phyto_costs_2_Qt"] = flat_df['phyto_costs'] / flat_df['produced_quantity']
-#
-#
-# flat_df["fert_costs_2_Qt"] = flat_df['fert_costs'] / flat_df['produced_quantity']
-#
-#
-#
-#
-# # ======= PYTHO AGGREGATION and Normaliztion to acrage==============================
-# # Step 2: Basic Feature Engineering
-# # Identify all columns related to herbicides
-# herbicide_cols = [elem for elem in flat_df.columns if "Herbicide_Qt" in elem]
-# # Compute the herbicide ratio relative to crop acreage
-# flat_df["herbicide_ratio"] = (
-# 		flat_df[herbicide_cols].sum(axis=1) / flat_df["crop_acreage"]
-# )
-#
-# insecticide_cols = [elem for elem in flat_df.columns if "Insecticide_Qt" in elem]
-# # Compute the herbicide ratio relative to crop acreage
-# flat_df["insecticide_ratio"] = (
-# 		flat_df[insecticide_cols].sum(axis=1) / flat_df["crop_acreage"]
-# )
-#
-# fungicide_cols = [elem for elem in flat_df.columns if "Fungicide_Qt" in elem]
-# # Compute the herbicide ratio relative to crop acreage
-# flat_df["fungicide_ratio"] = (
-# 		flat_df[fungicide_cols].sum(axis=1) / flat_df["crop_acreage"]
-# )
-#
-# # Step 3: Performance Ratios
-# # Calculate the ratio of herbicide use relative to yield
-# flat_df["herbicide_ratio_over_yield"] = flat_df["herbicide_ratio"] / flat_df["farm_yield"]
-# flat_df["insecticide_ratio_over_yield"] = flat_df["insecticide_ratio"] / flat_df["farm_yield"]
-# flat_df["fungicide_ratio_over_yield"] = flat_df["fungicide_ratio"] / flat_df["farm_yield"]
-#
-# phyto_cols = ["herbicide_ratio_over_yield","insecticide_ratio_over_yield","fungicide_ratio_over_yield"]
-# flat_df["phyto_ratio_over_yield"] = (
-# 		flat_df[phyto_cols].sum(axis=1)
-# )
-#
-# # ======= Ferti AGGREGATION and Normaliztion to acrage==============================
-# # Define columns representing essential elements for crop nutrition
-# keywords = ['nitrogen_ha', 'phosphorus_ha', 'potassium_ha']
-# new_cols = ['Nha_ratio','Pha_ratio','Kha_ratio']
-# for k,c in zip(keywords,new_cols):
-# 	x_cols = [elem for elem in flat_df.columns if k in elem]
-# 	flat_df[c] = flat_df[x_cols].sum(axis=1)/ flat_df["farm_yield"]
-#
-#
-# # Calculate total elements ratio over yield
-# flat_df["ferti_ratio_over_yield"] = flat_df[new_cols].sum(axis=1)
-#
-# # Calculate hours of machinery use per hectare relative to yield
-# flat_df["hours_of_machines_ha_over_yield"] = (
-# 		flat_df["hours_of_machines_ha"] / flat_df["farm_yield"]
-# )
-#
 
 # ======= INU FEATURES ==============================
 # Step 4: Filter Relevant Columns
@@ -112,6 +45,9 @@ input_l = [
 # 	'hours_of_machines_ha_over_yield']
 # ]
 
+# the features missing from the flat panel are computed, see DB_population/feature_utils
+flat_df = add_features(flat_df, input_l)
+
 # Step 5: Handle Infinite Values
 # Remove rows containing infinite values in the specified input columns
 is_finite = ~np.isinf(flat_df[input_l]).any(axis=1)
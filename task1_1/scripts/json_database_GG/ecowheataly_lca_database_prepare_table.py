@@ -2,68 +2,57 @@
 import json
 import pandas as pd;
 
+from DB_population.schema_utils import DatastoreView, crop_names
 
-#load ecowheataly_database.json
+
+#load ecowheataly_database.json through the logical view (see DB_population/schema_utils):
+#the Italian- and the English-key layouts are both read, with these differences
+# - the English layout has the hours of machines per hectare only, and the N/P/K per
+#   fertilizer type, summed here (schema_utils.DERIVED)
+# - its pesticides are given per toxicity class, not per product, so the treatments are
+#   counted over the classes
+# - it has no 5-class altimetric zone: the altimetria column is then empty
 
 #if 'ewdata' not in locals():
 if True:
     with open("ecowheataly_database_lca.json") as ewdj:
-        ewdata = json.load(ewdj)
-
-farm_keys=list(ewdata.keys())
+        ewdata = DatastoreView(json.load(ewdj))
 
 
 data_for_table=[]
-for key in farm_keys:
-    tmp_farm_data=ewdata.get(key)
-    provincia=tmp_farm_data['geo']
-    altimetria=tmp_farm_data['zona altimetrica 5']
-    tmp_farm_years=tmp_farm_data['years'].keys()
-    for y in tmp_farm_years:
-        tmp_farm_year_colture=tmp_farm_data['years'][y]['colture'].keys()
-        if 'Frumento duro' in tmp_farm_year_colture and len(tmp_farm_year_colture)==1:
-        #if 'Frumento duro' in tmp_farm_year_colture:
-            hom=tmp_farm_data['years'][y]['colture']['Frumento duro']['hours of own machines']
-            hrm=tmp_farm_data['years'][y]['colture']['Frumento duro']['hours of rent machines']
-            if hrm==float('inf'):
-                hrm=0
-            lu=tmp_farm_data['years'][y]['colture']['Frumento duro']['land_use(ha)']
-            if lu>0 and (hom+hrm)!=0:
-                luph=round((hom+hrm)/lu,2)
+for key, tmp_farm_data in ewdata.items():
+    provincia=tmp_farm_data['province']
+    altimetria=tmp_farm_data.get('Zona_Altimetrica_5')
+    for y, tmp_farm_year in tmp_farm_data['years'].items():
+        tmp_farm_year_colture=crop_names(tmp_farm_year)
+        if 'durum_wheat' in tmp_farm_year_colture and len(tmp_farm_year_colture)==1:
+        #if 'durum_wheat' in tmp_farm_year_colture:
+            crop=tmp_farm_year['durum_wheat']
+            lu=crop['crop_acreage']
+            hpha=crop['hours_of_machines_ha']
+            if lu>0 and hpha!=0:
+                luph=round(hpha,2)
                 #Fertilizzanti
-                Nxha=tmp_farm_data['years'][y]['colture']['Frumento duro']['fertilizzanti']['azoto a ha(kg)']
-                Pxha=tmp_farm_data['years'][y]['colture']['Frumento duro']['fertilizzanti']['fosforo a ha(kg)']
-                Kxha=tmp_farm_data['years'][y]['colture']['Frumento duro']['fertilizzanti']['potassio a ha(kg)']
-
-                #Pesticidi
-                number_of_herbicides_treatments=0
-                number_of_insecticides_treatments=0
-                number_of_coajuvants_treatments=0
-                tmp_farm_year_colture_fito=tmp_farm_data['years'][y]['colture']['Frumento duro']['fitofarmaci']
-                if 'Herbicides' in tmp_farm_year_colture_fito:
-                    herb_keys=tmp_farm_year_colture_fito['Herbicides'].keys()
-                    for hk in herb_keys:
-                        surface=tmp_farm_data['years'][y]['colture']['Frumento duro']['fitofarmaci']['Herbicides'][hk]['superficie trattata(ha)']
-                        number_of_herbicides_treatments+=round(surface/lu)
-                if 'Insecticides' in tmp_farm_year_colture_fito:
-                    insect_keys=tmp_farm_year_colture_fito['Insecticides'].keys()
-                    for ik in insect_keys:
-                        surface=tmp_farm_data['years'][y]['colture']['Frumento duro']['fitofarmaci']['Insecticides'][ik]['superficie trattata(ha)']
-                        number_of_insecticides_treatments+=round(surface/lu)
-                if 'Co-adjuvants' in tmp_farm_year_colture_fito:
-                    coad_keys=tmp_farm_year_colture_fito['Co-adjuvants'].keys()
-                    for ck in coad_keys:
-                        surface=tmp_farm_data['years'][y]['colture']['Frumento duro']['fitofarmaci']['Co-adjuvants'][ck]['superficie trattata(ha)']
-                        number_of_coajuvants_treatments+=round(surface/lu)
-                    #print([key,y,'Frumento duro',lu,luph,Nxha,Pxha,Kxha,number_of_herbicides_treatments,number_of_insecticides_treatments,number_of_coajuvants_treatments])
-
-
-                data_for_table.append([key,y,lu,luph,Nxha,Pxha,Kxha,number_of_herbicides_treatments,number_of_insecticides_treatments,number_of_coajuvants_treatments,provincia,altimetria])
+                fert=crop.get('fertilizers',{})
+                Nxha=fert.get('nitrogen_ha',float('nan'))
+                Pxha=fert.get('phosphorus_ha',float('nan'))
+                Kxha=fert.get('potassium_ha',float('nan'))
+
+                #Pesticidi: treatments of each type, from the surface of its products (classes)
+                tmp_farm_year_colture_fito=crop.get('phytosanitary',{})
+                n_treatments={}
+                for phyto_type in ['Herbicide','Insecticide','Coadjuvant']:
+                    n_treatments[phyto_type]=0
+                    for product in tmp_farm_year_colture_fito.get(phyto_type,{}).values():
+                        n_treatments[phyto_type]+=round(product['phyto_area']/lu)
+                #print([key,y,'durum_wheat',lu,luph,Nxha,Pxha,Kxha,n_treatments])
+
+
+                data_for_table.append([key,y,lu,luph,Nxha,Pxha,Kxha,n_treatments['Herbicide'],n_treatments['Insecticide'],n_treatments['Coadjuvant'],provincia,altimetria])
                 #print([key,y,'Frumento duro',lu,luph])
             else:
                 print('land use=0 or hours of tractors=0')
-                print([key,y,'Frumento duro',lu,hom+hrm])
-
+                print([key,y,'Frumento duro',lu,hpha])
 
 import pandas as pd
 table_df=pd.DataFrame(data=data_for_table,columns=['Farm ID','Year','Superficie coltivata','Ore uso macchina per ettaro','kg azoto per ettaro','kg fosforo per ettaro','kg potassio per ettaro','n trattamenti diserbanti','n trattamenti insetticidi','n trattamenti coadiuvanti','provincia','altimetria'])
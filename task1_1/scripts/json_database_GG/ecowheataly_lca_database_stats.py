@@ -3,21 +3,24 @@ import os
 import json
 import pandas as pd;
 
+from DB_population.schema_utils import DatastoreView, crop_names
+
 write_latex_tables_to_file=False
 
-#load ecowheataly_database.json
+#load ecowheataly_database.json through the logical view, so that the Italian- and the
+#English-key layouts are both read (see DB_population/schema_utils)
 
 #if 'ewdata' not in locals():
 if True:
     with open("ecowheataly_database_lca.json") as ewdj:
-        ewdata = json.load(ewdj)
+        ewdata = DatastoreView(json.load(ewdj))
 
 farm_keys=list(ewdata.keys())
 
 
 #number of years each firm appears in the database
 
-counts=[ewdata.get(key)["count_in_farms_file(years)"] for key in ewdata]
+counts=[ewdata.get(key)['n_years_in_farms_file'] for key in ewdata]
 #compute a frequency table
 c_s=pd.Series(counts)
 ages=c_s.value_counts()
@@ -30,10 +33,10 @@ if write_latex_tables_to_file:
          tf.write(ages_sorted.to_latex(index=False,column_format="cc"))
 
 #get farms that appear most often
-elder=[[key,ewdata.get(key)["count_in_farms_file(years)"]] for key in ewdata if ewdata.get(key)["count_in_farms_file(years)"]==max(ages.index)]
+elder=[[key,ewdata.get(key)['n_years_in_farms_file']] for key in ewdata if ewdata.get(key)['n_years_in_farms_file']==max(ages.index)]
 #print info on the first farm of the list
 code=elder[0][0]
-json_item=json.dumps(ewdata[code],indent=4)
+json_item=json.dumps(ewdata[code].data,indent=4)
 
 
 #identify years and provinces
@@ -42,7 +45,7 @@ allprovinces=[]
 for key in farm_keys:
     farm_years=list(ewdata.get(key)['years'].keys())
     allyears.extend(farm_years)
-    allprovinces.append(ewdata.get(key)['geo'])
+    allprovinces.append(ewdata.get(key)['province'])
 
 str_period=sorted(list(set(allyears)))
 int_period=[int(y) for y in str_period]
@@ -84,85 +87,85 @@ for i in range(0,len(str_period)):
     for key in farm_keys:
         if str_period[i] in ewdata.get(key)['years'].keys():
             n_farms[i]+=1
-            if len(ewdata.get(key)['years'][str_period[i]]['colture'].keys())==1:
-                if 'Frumento tenero' in ewdata.get(key)['years'][str_period[i]]['colture'].keys():
+            if len(crop_names(ewdata.get(key)['years'][str_period[i]]))==1:
+                if 'common_wheat' in crop_names(ewdata.get(key)['years'][str_period[i]]):
                     n_farms_soft[i]+=1
-                    province_year_soft_table.at[ewdata.get(key)['geo'],str_period[i]]+=1
-                    this_farm_wheat_land_use=round(ewdata.get(key)['years'][str_period[i]]['colture']['Frumento tenero']['land_use(ha)'],2)
-                    this_farm_total_land_use=round(ewdata.get(key)['years'][str_period[i]]['SAU(ha)'],2)
+                    province_year_soft_table.at[ewdata.get(key)['province'],str_period[i]]+=1
+                    this_farm_wheat_land_use=round(ewdata.get(key)['years'][str_period[i]]['common_wheat']['crop_acreage'],2)
+                    this_farm_total_land_use=round(ewdata.get(key)['years'][str_period[i]]['farm_acreage'],2)
                     if this_farm_total_land_use>0:  #a few firms have total land use equal to zero
                         if this_farm_wheat_land_use>threshold_on_land_use_value:
                             this_farm_land_use_ratio=round(this_farm_wheat_land_use/this_farm_total_land_use,2)
                             if this_farm_land_use_ratio>threshold_on_land_use_ratio:
                                 n_farms_soft_above_thresholds[i]+=1
                     hectares_soft_only[i]+=this_farm_wheat_land_use
-                    if ewdata.get(key)['years'][str_period[i]]['colture']['Frumento tenero']['fertilizzanti']['numero_items_in_file']>0:
+                    if ewdata.get(key)['years'][str_period[i]]['common_wheat'].get('fertilizers',{}).get('n_items',0)>0:
                         n_farms_soft_using_fertilizers[i]+=1
-                    if ewdata.get(key)['years'][str_period[i]]['colture']['Frumento tenero']['fitofarmaci']['numero_items_in_file']>0:
-                        if len(ewdata.get(key)['years'][str_period[i]]['colture']['Frumento tenero']['fitofarmaci']['Herbicides'].keys())>0:
+                    if ewdata.get(key)['years'][str_period[i]]['common_wheat'].get('phytosanitary',{}).get('n_items',0)>0:
+                        if len(ewdata.get(key)['years'][str_period[i]]['common_wheat'].get('phytosanitary',{}).get('Herbicide',{}))>0:
                             n_farms_soft_using_herbicides[i]+=1
-                        if len(ewdata.get(key)['years'][str_period[i]]['colture']['Frumento tenero']['fitofarmaci']['Insecticides'].keys())>0:
+                        if len(ewdata.get(key)['years'][str_period[i]]['common_wheat'].get('phytosanitary',{}).get('Insecticide',{}))>0:
                             n_farms_soft_using_insecticides[i]+=1
-                        if len(ewdata.get(key)['years'][str_period[i]]['colture']['Frumento tenero']['fitofarmaci']['Co-adjuvants'].keys())>0:
+                        if len(ewdata.get(key)['years'][str_period[i]]['common_wheat'].get('phytosanitary',{}).get('Coadjuvant',{}))>0:
                             n_farms_soft_using_coadjuvants[i]+=1
                 else:
                     n_farms_hard[i]+=1
-                    province_year_hard_table.at[ewdata.get(key)['geo'],str_period[i]]+=1
-                    this_farm_wheat_land_use=round(ewdata.get(key)['years'][str_period[i]]['colture']['Frumento duro']['land_use(ha)'],2)
-                    this_farm_total_land_use=round(ewdata.get(key)['years'][str_period[i]]['SAU(ha)'],2)
+                    province_year_hard_table.at[ewdata.get(key)['province'],str_period[i]]+=1
+                    this_farm_wheat_land_use=round(ewdata.get(key)['years'][str_period[i]]['durum_wheat']['crop_acreage'],2)
+                    this_farm_total_land_use=round(ewdata.get(key)['years'][str_period[i]]['farm_acreage'],2)
                     if this_farm_total_land_use>0:  #a few firms have total land use equal to zero
                         if this_farm_wheat_land_use>threshold_on_land_use_value:
                             this_farm_land_use_ratio=round(this_farm_wheat_land_use/this_farm_total_land_use,2)
                             if this_farm_land_use_ratio>threshold_on_land_use_ratio:
                                 n_farms_hard_above_thresholds[i]+=1
-                    hectares_hard_only[i]+=round(ewdata.get(key)['years'][str_period[i]]['colture']['Frumento duro']['land_use(ha)'],2)
-                    if ewdata.get(key)['years'][str_period[i]]['colture']['Frumento duro']['fertilizzanti']['numero_items_in_file']>0:
+                    hectares_hard_only[i]+=round(ewdata.get(key)['years'][str_period[i]]['durum_wheat']['crop_acreage'],2)
+                    if ewdata.get(key)['years'][str_period[i]]['durum_wheat'].get('fertilizers',{}).get('n_items',0)>0:
                         n_farms_hard_using_fertilizers[i]+=1
-                    if ewdata.get(key)['years'][str_period[i]]['colture']['Frumento duro']['fitofarmaci']['numero_items_in_file']>0:
-                        if len(ewdata.get(key)['years'][str_period[i]]['colture']['Frumento duro']['fitofarmaci']['Herbicides'].keys())>0:
+                    if ewdata.get(key)['years'][str_period[i]]['durum_wheat'].get('phytosanitary',{}).get('n_items',0)>0:
+                        if len(ewdata.get(key)['years'][str_period[i]]['durum_wheat'].get('phytosanitary',{}).get('Herbicide',{}))>0:
                             n_farms_hard_using_herbicides[i]+=1
-                        if len(ewdata.get(key)['years'][str_period[i]]['colture']['Frumento duro']['fitofarmaci']['Insecticides'].keys())>0:
+                        if len(ewdata.get(key)['years'][str_period[i]]['durum_wheat'].get('phytosanitary',{}).get('Insecticide',{}))>0:
                             n_farms_hard_using_insecticides[i]+=1
-                        if len(ewdata.get(key)['years'][str_period[i]]['colture']['Frumento duro']['fitofarmaci']['Co-adjuvants'].keys())>0:
+                        if len(ewdata.get(key)['years'][str_period[i]]['durum_wheat'].get('phytosanitary',{}).get('Coadjuvant',{}))>0:
                             n_farms_hard_using_coadjuvants[i]+=1
-            if len(ewdata.get(key)['years'][str_period[i]]['colture'].keys())==2:
+            if len(crop_names(ewdata.get(key)['years'][str_period[i]]))==2:
                     n_farms_both[i]+=1
-                    province_year_both_table.at[ewdata.get(key)['geo'],str_period[i]]+=1
-                    this_farm_wheat_land_use=round(ewdata.get(key)['years'][str_period[i]]['colture']['Frumento tenero']['land_use(ha)']+ewdata.get(key)['years'][str_period[i]]['colture']['Frumento duro']['land_use(ha)'],2)
-                    this_farm_total_land_use=round(ewdata.get(key)['years'][str_period[i]]['SAU(ha)'],2)
+                    province_year_both_table.at[ewdata.get(key)['province'],str_period[i]]+=1
+                    this_farm_wheat_land_use=round(ewdata.get(key)['years'][str_period[i]]['common_wheat']['crop_acreage']+ewdata.get(key)['years'][str_period[i]]['durum_wheat']['crop_acreage'],2)
+                    this_farm_total_land_use=round(ewdata.get(key)['years'][str_period[i]]['farm_acreage'],2)
                     if this_farm_total_land_use>0:  #a few firms have total land use equal to zero
                         if this_farm_wheat_land_use>threshold_on_land_use_value:
                             this_farm_land_use_ratio=round(this_farm_wheat_land_use/this_farm_total_land_use,2)
                             if this_farm_land_use_ratio>threshold_on_land_use_ratio:
                                 n_farms_both_above_thresholds[i]+=1
-                    hectares_soft_both[i]+=round(ewdata.get(key)['years'][str_period[i]]['colture']['Frumento tenero']['land_use(ha)'],2)
-                    hectares_hard_both[i]+=round(ewdata.get(key)['years'][str_period[i]]['colture']['Frumento duro']['land_use(ha)'],2)
+                    hectares_soft_both[i]+=round(ewdata.get(key)['years'][str_period[i]]['common_wheat']['crop_acreage'],2)
+                    hectares_hard_both[i]+=round(ewdata.get(key)['years'][str_period[i]]['durum_wheat']['crop_acreage'],2)
                     
-                    tmp1=ewdata.get(key)['years'][str_period[i]]['colture']['Frumento duro']['fertilizzanti']['numero_items_in_file']
-                    tmp2=ewdata.get(key)['years'][str_period[i]]['colture']['Frumento tenero']['fertilizzanti']['numero_items_in_file']
+                    tmp1=ewdata.get(key)['years'][str_period[i]]['durum_wheat'].get('fertilizers',{}).get('n_items',0)
+                    tmp2=ewdata.get(key)['years'][str_period[i]]['common_wheat'].get('fertilizers',{}).get('n_items',0)
                     
                     if (tmp1>0) or (tmp2>0):
                         n_farms_both_using_fertilizers[i]+=1
                     
-                    tmp1=ewdata.get(key)['years'][str_period[i]]['colture']['Frumento duro']['fitofarmaci']['numero_items_in_file']
-                    tmp2=ewdata.get(key)['years'][str_period[i]]['colture']['Frumento tenero']['fitofarmaci']['numero_items_in_file']
+                    tmp1=ewdata.get(key)['years'][str_period[i]]['durum_wheat'].get('phytosanitary',{}).get('n_items',0)
+                    tmp2=ewdata.get(key)['years'][str_period[i]]['common_wheat'].get('phytosanitary',{}).get('n_items',0)
                     
                     if (tmp1>0) or (tmp2>0):
                         
-                        tmp1 = ewdata.get(key)['years'][str_period[i]]['colture']['Frumento duro']['fitofarmaci'].get("Herbicides")
-                        tmp2 = ewdata.get(key)['years'][str_period[i]]['colture']['Frumento tenero']['fitofarmaci'].get("Herbicides")
+                        tmp1 = ewdata.get(key)['years'][str_period[i]]['durum_wheat'].get('phytosanitary',{}).get('Herbicide')
+                        tmp2 = ewdata.get(key)['years'][str_period[i]]['common_wheat'].get('phytosanitary',{}).get('Herbicide')
                         
                         if tmp1 or tmp2:
                             n_farms_both_using_herbicides[i]+=1
                         
-                        tmp1 = ewdata.get(key)['years'][str_period[i]]['colture']['Frumento duro']['fitofarmaci'].get("Insecticides")
-                        tmp2 = ewdata.get(key)['years'][str_period[i]]['colture']['Frumento tenero']['fitofarmaci'].get("Insecticides")
+                        tmp1 = ewdata.get(key)['years'][str_period[i]]['durum_wheat'].get('phytosanitary',{}).get('Insecticide')
+                        tmp2 = ewdata.get(key)['years'][str_period[i]]['common_wheat'].get('phytosanitary',{}).get('Insecticide')
                         
                         if tmp1 or tmp2:
                             n_farms_both_using_insecticides[i]+=1
                         
-                        tmp1 = ewdata.get(key)['years'][str_period[i]]['colture']['Frumento duro']['fitofarmaci'].get('Co-adjuvants')
-                        tmp2 = ewdata.get(key)['years'][str_period[i]]['colture']['Frumento tenero']['fitofarmaci'].get('Co-adjuvants')
+                        tmp1 = ewdata.get(key)['years'][str_period[i]]['durum_wheat'].get('phytosanitary',{}).get('Coadjuvant')
+                        tmp2 = ewdata.get(key)['years'][str_period[i]]['common_wheat'].get('phytosanitary',{}).get('Coadjuvant')
                         
                         if tmp1 or tmp2:
                             n_farms_both_using_coadjuvants[i]+=1